@@ -1,4 +1,15 @@
-from typing import List
+import hashlib
+import math
+import os
+import sqlite3
+import tempfile
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from operator import attrgetter
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, Tuple
 
 
 def remove_invalid(items: List[int]):
@@ -22,13 +33,26 @@ Python之禅：显式优于隐式
 """
 
 # 不要有太多变量，对局部变量分组建模
+class User(NamedTuple):
+    """待导入的用户"""
+
+    username: str
+    email: str
+
+
 class ImportedSummary:
-    """保存导入结果摘要的数据类"""
+    """保存导入结果摘要的数据类，计数随着每批数据的写入逐步累加"""
 
     def __init__(self):
         self.succeeded_count = 0
         self.failed_count = 0
 
+    def add(self, succeeded_count: int = 0, failed_count: int = 0):
+        """累加一批数据的成功与失败数量"""
+        self.succeeded_count += succeeded_count
+        self.failed_count += failed_count
+
+
 class ImportingUserGroup:
     """用于暂存用户导入处理的数据类"""
 
@@ -37,26 +61,406 @@ class ImportingUserGroup:
         self.banned = []
         self.normal = []
 
+    def clear(self):
+        """清空暂存的用户，在每批数据写入后调用"""
+        self.duplicated.clear()
+        self.banned.clear()
+        self.normal.clear()
 
-def parse_user(line):
-    pass
 
+def parse_user(line: str) -> Optional[User]:
+    """解析一行 "用户名,邮箱" 格式的用户数据，格式不合法时返回 None"""
+    fields = line.strip().split(',')
+    if len(fields) != 2 or not all(fields):
+        return None
+    username, email = fields
+    return User(username=username, email=email)
+
+
+class UserSink(ABC):
+    """抽象类：用户数据的写入目标"""
+
+    @abstractmethod
+    def find_existing(self, usernames: Set[str]) -> Set[str]:
+        """返回 usernames 中已经存在的用户名"""
+
+    @abstractmethod
+    def write_many(self, users: List[User]) -> int:
+        """批量写入用户，返回成功写入的数量"""
+
+
+class MemoryUserSink(UserSink):
+    """把用户保存在内存字典中，适合测试使用"""
+
+    def __init__(self):
+        self.users: Dict[str, User] = {}
+
+    def find_existing(self, usernames: Set[str]) -> Set[str]:
+        return {name for name in usernames if name in self.users}
+
+    def write_many(self, users: List[User]) -> int:
+        self.users.update((user.username, user) for user in users)
+        return len(users)
+
+
+class SQLiteUserSink(UserSink):
+    """把用户写入 SQLite 数据库
+
+    :param path: 数据库文件路径，默认使用内存数据库。使用文件时，多个进程可以同时写入同一个数据库
+    """
+
+    # SQLite 对单条语句里的参数数量有限制，查询时需要分批
+    max_query_params = 500
+
+    def __init__(self, path: str = ':memory:'):
+        self.path = path
+        self.conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        # 其他进程正在写入时，最多等待 timeout 秒
+        conn = sqlite3.connect(self.path, timeout=60)
+        if self.path != ':memory:':
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, email TEXT)')
+        return conn
+
+    def __getstate__(self):
+        # 与 SQLiteBanList 一样，传给子进程时只传递路径
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.conn = self._connect()
+
+    def find_existing(self, usernames: Set[str]) -> Set[str]:
+        existing = set()
+        for names in iter_chunks(usernames, self.max_query_params):
+            placeholders = ','.join('?' * len(names))
+            rows = self.conn.execute(
+                f'SELECT username FROM users WHERE username IN ({placeholders})', names
+            )
+            existing.update(name for name, in rows)
+        return existing
+
+    def write_many(self, users: List[User]) -> int:
+        with self.conn:
+            cursor = self.conn.executemany('INSERT OR IGNORE INTO users VALUES (?, ?)', users)
+        return cursor.rowcount
+
+
+def iter_chunks(iterable: Iterable, size: int) -> Iterator[list]:
+    """把可迭代对象切分为长度不超过 size 的多个列表"""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+# 使用集合判断成员是否存在，避免每行数据都遍历一次列表
+class UserIndex:
+    """基于哈希集合的用户索引，按身份字段判断用户是否已出现过
+
+    :param key_fields: 用于识别同一用户的字段
+    """
+
+    def __init__(self, key_fields: Tuple[str, ...] = ('username',)):
+        self.key_fields = key_fields
+        self._get_key = attrgetter(*key_fields)
+        self._keys = set()
+
+    def add(self, user: User) -> bool:
+        """添加用户，如果用户已经存在，返回 False"""
+        key = self._get_key(user)
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
+
+    def __contains__(self, user: User) -> bool:
+        return self._get_key(user) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class BanList(ABC):
+    """抽象类：被封禁用户名的名单，适用于普通集合放不进内存的情况"""
+
+    @abstractmethod
+    def __contains__(self, username: str) -> bool:
+        raise NotImplementedError()
+
+    @abstractmethod
+    def update(self, usernames: Iterable[str]):
+        """批量添加被封禁的用户名"""
+        raise NotImplementedError()
+
+
+class SQLiteBanList(BanList):
+    """保存在 SQLite 文件里的封禁名单，多个进程可以共用同一个文件
+
+    :param path: 数据库文件路径
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE IF NOT EXISTS banned (username TEXT PRIMARY KEY)')
+        return conn
 
-def import_users_from_file(fp):
+    def __contains__(self, username: str) -> bool:
+        row = self.conn.execute('SELECT 1 FROM banned WHERE username = ?', (username,)).fetchone()
+        return row is not None
+
+    def update(self, usernames: Iterable[str]):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO banned VALUES (?)', ((name,) for name in usernames)
+            )
+
+    def __getstate__(self):
+        # 数据库连接无法被 pickle，传给子进程时只传递路径，由子进程重新连接
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.path = state['path']
+        self.conn = self._connect()
+
+
+class BloomBanList(BanList):
+    """基于布隆过滤器的封禁名单，无论名单多大，占用的内存都是固定的
+
+    布隆过滤器不会漏判，但有一定概率把正常用户误判为已封禁。如果提供了 backing 名单，
+    过滤器命中后会再到 backing 里确认，此时结果是精确的，而绝大多数正常用户不需要访问磁盘。
+
+    :param capacity: 预计的名单大小
+    :param error_rate: 可接受的误判率
+    :param backing: 用于确认结果的精确名单，比如 SQLiteBanList。已经在 backing 中的用户名不会自动加入过滤器，
+        需要再调用一次 update()
+    """
+
+    def __init__(self, capacity: int, error_rate: float = 0.001, backing: Optional[BanList] = None):
+        if capacity <= 0:
+            raise ValueError('capacity must be a positive integer')
+        if not 0 < error_rate < 1:
+            raise ValueError('error_rate must be between 0 and 1')
+        self.bit_count = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.backing = backing
+
+    def _positions(self, username: str) -> Iterator[int]:
+        # 双重哈希：用两个 64 位哈希值组合出 hash_count 个位置
+        digest = hashlib.blake2b(username.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.bit_count for i in range(self.hash_count))
+
+    def __contains__(self, username: str) -> bool:
+        for pos in self._positions(username):
+            if not self.bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return self.backing is None or username in self.backing
+
+    def update(self, usernames: Iterable[str]):
+        """添加被封禁的用户名，提供了 backing 名单时同时写入 backing"""
+        # 分批处理，名单很大时也不需要一次性读入内存
+        for chunk in iter_chunks(usernames, 10000):
+            if self.backing is not None:
+                self.backing.update(chunk)
+            for username in chunk:
+                for pos in self._positions(username):
+                    self.bits[pos >> 3] |= 1 << (pos & 7)
+
+
+class UserImporter:
+    """流式导入用户：按固定大小分块读取、解析与分类，然后批量写入目标。
+
+    内存里最多只保留一块数据，因此即使文件很大，内存占用也保持平稳。
+    块内的重复用户由 UserIndex 识别，跨块的重复用户交给写入目标按用户名判断。
+
+    :param sink: 用户数据的写入目标
+    :param banned_usernames: 被封禁的用户名，名单很大时可以传入 BanList 对象
+    :param chunk_size: 每块数据的行数
+    """
+
+    def __init__(
+        self,
+        sink: UserSink,
+        banned_usernames: Iterable[str] = (),
+        chunk_size: int = 10000,
+    ):
+        self.sink = sink
+        if not isinstance(banned_usernames, BanList):
+            banned_usernames = set(banned_usernames)
+        self.banned_usernames = banned_usernames
+        self.chunk_size = chunk_size
+
+    def import_from_file(self, fp) -> ImportedSummary:
+        """从文件对象中读取并导入用户"""
+        summary = ImportedSummary()
+        importing_user_group = ImportingUserGroup()
+        for lines in iter_chunks(fp, self.chunk_size):
+            self.classify(lines, importing_user_group, summary)
+            self.flush(importing_user_group, summary)
+        return summary
+
+    def classify(self, lines: Iterable[str], group: ImportingUserGroup, summary: ImportedSummary):
+        """解析一块数据，将用户分类到 group 中，无法解析的行计为失败"""
+        seen_index = UserIndex()
+        for line in lines:
+            user = parse_user(line)
+            if user is None:
+                summary.add(failed_count=1)
+            elif user in seen_index:
+                group.duplicated.append(user)
+            elif user.username in self.banned_usernames:
+                group.banned.append(user)
+            else:
+                seen_index.add(user)
+                group.normal.append(user)
+
+    def flush(self, group: ImportingUserGroup, summary: ImportedSummary):
+        """将 group 中的正常用户批量写入目标，更新摘要后清空 group"""
+        existing = self.sink.find_existing({user.username for user in group.normal})
+        if existing:
+            group.duplicated.extend(user for user in group.normal if user.username in existing)
+            group.normal = [user for user in group.normal if user.username not in existing]
+
+        written_count = self.sink.write_many(group.normal)
+        summary.add(
+            succeeded_count=written_count,
+            failed_count=len(group.duplicated) + len(group.banned) + len(group.normal) - written_count,
+        )
+        group.clear()
+
+
+def import_users_from_file(fp, sink: Optional[UserSink] = None, chunk_size: int = 10000):
     """尝试从文件对象读取用户，然后导入数据库　　
 
     :param fp: 可读文件对象
+    :param sink: 用户数据的写入目标，默认写入内存
+    :param chunk_size: 每批处理的行数
     :return: 成功与失败的数量
     """
-    importing_user_group = ImportingUserGroup()
-    for line in fp:
-        parsed_user = parse_user(line)
-        # …… 进行判断处理，修改上面定义的importing_user_group 变量
+    importer = UserImporter(sink or MemoryUserSink(), chunk_size=chunk_size)
+    summary = importer.import_from_file(fp)
+    return summary.succeeded_count, summary.failed_count
+
+
+# 并行导入：把大文件按字节范围切分为多个分片，在进程池中并行解析
+def split_file_shards(path: str, shard_size: int) -> List[Tuple[int, int]]:
+    """按字节范围切分文件，每个分片的边界都对齐到换行符之后
+
+    :param path: 文件路径
+    :param shard_size: 每个分片的大致字节数
+    :return: 由 (起始位置, 结束位置) 组成的列表
+    """
+    file_size = os.path.getsize(path)
+    shards = []
+    with open(path, 'rb') as fp:
+        start = 0
+        while start < file_size:
+            end = start + shard_size
+            if end >= file_size:
+                end = file_size
+            else:
+                # 从 end 前一个字节开始读到行尾，保证边界落在换行符之后
+                fp.seek(end - 1)
+                fp.readline()
+                end = fp.tell()
+            shards.append((start, end))
+            start = end
+    return shards
+
+
+# 子进程内使用的导入器，由进程池的 initializer 创建，避免每个任务都重复传递封禁名单与写入目标
+_shard_importer: Optional[UserImporter] = None
+
+
+def _init_shard_worker(sink: UserSink, banned_usernames, chunk_size: int):
+    global _shard_importer
+    _shard_importer = UserImporter(sink, banned_usernames, chunk_size)
+
+
+def _import_shard(path: str, start: int, end: int, encoding: str) -> ImportedSummary:
+    """在子进程中导入一个分片，只把导入结果摘要传回主进程"""
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        lines = fp.read(end - start).decode(encoding).splitlines()
+    return _shard_importer.import_from_file(lines)
 
+
+def import_users_parallel(
+    path: str,
+    sink: UserSink,
+    banned_usernames: Iterable[str] = (),
+    shard_size: int = 8 * 1024 * 1024,
+    max_workers: Optional[int] = None,
+    encoding: str = 'utf-8',
+    chunk_size: int = 10000,
+) -> ImportedSummary:
+    """并行导入用户：每个子进程独立解析、分类并写入自己的分片，主进程只负责汇总结果摘要。
+
+    sink 会被 pickle 后传给子进程，所以它必须能在多个进程之间共享数据，比如使用数据库文件的
+    SQLiteUserSink；MemoryUserSink 在子进程中只是一份副本。跨分片的重复用户由写入目标判断，
+    成功与失败的数量与串行导入一致，但同一用户名在多个分片里出现时，保留哪一条记录是不确定的。
+    同时处理中的分片数量有上限，内存占用不会随文件大小增长。
+
+    :param path: 用户数据文件路径
+    :param sink: 用户数据的写入目标
+    :param banned_usernames: 被封禁的用户名，名单很大时可以传入 BanList 对象
+    :param shard_size: 每个分片的大致字节数
+    :param max_workers: 进程数，默认为 CPU 核数
+    :param encoding: 文件编码
+    :param chunk_size: 子进程每次写入的行数
+    """
+    if not isinstance(banned_usernames, BanList):
+        banned_usernames = set(banned_usernames)
     summary = ImportedSummary()
-    # …… 读取 importing_user_group，写入数据库并修改成功与失败的数量
+    max_workers = max_workers or os.cpu_count() or 1
+    shards = iter(split_file_shards(path, shard_size))
 
-    return summary.succeeded_count, summary.failed_count
+    with ProcessPoolExecutor(
+        max_workers, initializer=_init_shard_worker, initargs=(sink, banned_usernames, chunk_size)
+    ) as executor:
+        pending = deque()
+        for start, end in islice(shards, max_workers * 2):
+            pending.append(executor.submit(_import_shard, path, start, end, encoding))
+
+        while pending:
+            shard_summary = pending.popleft().result()
+            for start, end in islice(shards, 1):
+                pending.append(executor.submit(_import_shard, path, start, end, encoding))
+            summary.add(shard_summary.succeeded_count, shard_summary.failed_count)
+    return summary
+
+
+def bench_import_parallel(path: str, worker_counts: Iterable[int] = (1, 2, 4, 8)):
+    """对比串行导入与不同进程数的并行导入吞吐量，每次都写入一个新的临时 SQLite 文件"""
+    with open(path, 'rb') as fp:
+        line_count = sum(1 for _ in fp)
+
+    def run(name, func):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sink = SQLiteUserSink(os.path.join(tmp_dir, 'users.db'))
+            st = time.perf_counter()
+            summary = func(sink)
+            cost = time.perf_counter() - st
+        print(
+            f'{name}: {cost:.2f}s, {line_count / cost:,.0f} lines/s, '
+            f'succeeded={summary.succeeded_count} failed={summary.failed_count}'
+        )
+
+    def import_serial(sink):
+        with open(path, encoding='utf-8') as fp:
+            return UserImporter(sink).import_from_file(fp)
+
+    run('serial', import_serial)
+    for workers in worker_counts:
+        run(f'{workers} workers', lambda sink: import_users_parallel(path, sink, max_workers=workers))
 
 
 """ Summarize
@@ -1,6 +1,12 @@
-from typing import List
+from typing import AsyncIterator, Dict, List, Optional
 from abc import ABC, abstractmethod
+from collections import defaultdict
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from urllib import parse
+import asyncio
+import threading
+import time
 import random
 import io
 import sys
@@ -28,11 +34,11 @@ class Duck:
         print(f"I am a {self.color} duck!")
 
 
-def create_random_ducks(number: int) -> List[Duck]:
-    ducks: List[Duck] = []
-    for _ in number:
-        color = random.choice(['yellow', 'white', 'gray'])
-        ducks.append(Duck(color=color))
+def create_random_ducks(number: int, seed: Optional[int] = None) -> List[Duck]:
+    # 一次性抽取所有颜色，使用独立的随机数生成器，相同的 seed 总会得到相同的结果
+    rng = random.Random(seed)
+    colors = rng.choices(['yellow', 'white', 'gray'], k=number)
+    ducks: List[Duck] = [Duck(color=color) for color in colors]
     return ducks
 
 
@@ -182,4 +188,445 @@ class HNTopPostsSpider:
 
 hosts = None
 hosts = ['github.com', 'bloomberg.com']
-crawler = HNTopPostsSpider(filter_by_hosts=hosts)
\ No newline at end of file
+crawler = HNTopPostsSpider(filter_by_hosts=hosts)
+
+
+# 4. 并发抓取：基于 asyncio，传输层、过滤算法都通过依赖注入提供
+class HNPostsParser(HTMLParser):
+    """解析 Hacker News 页面中的条目，解析完成的条目保存在 posts 列表中
+
+    可以分多次调用 feed()，被切断在两次调用之间的文本也能正确解析。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.posts: List[Post] = []
+        self._item = None
+        # 当前正在收集文本的字段名，以及已收集的文本片段
+        self._capturing = None
+        self._texts: List[str] = []
+        self._in_titleline = False
+        self._in_age = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        classes = (attrs.get('class') or '').split()
+        if tag == 'tr' and 'athing' in classes:
+            self._finish_item()
+            self._item = {'title': '', 'link': '', 'points': '0', 'comments_cnt': '0'}
+        elif self._item is None:
+            return
+        elif tag == 'span' and 'titleline' in classes:
+            self._in_titleline = True
+        elif tag == 'a' and self._in_titleline and not self._item['link']:
+            self._item['link'] = attrs.get('href', '')
+            self._start_capture('title')
+        elif tag == 'span' and 'score' in classes:
+            self._start_capture('points')
+        elif tag == 'span' and 'age' in classes:
+            self._in_age = True
+        elif tag == 'a' and not (self._in_titleline or self._in_age) and 'item?id=' in (attrs.get('href') or ''):
+            # 发布时间（"3 hours ago"）也链接到 item?id=，它位于 span.age 中，需要跳过
+            self._start_capture('comments_cnt')
+
+    def handle_endtag(self, tag):
+        if tag in ('a', 'span') and self._capturing:
+            self._finish_capture()
+        if tag == 'span':
+            self._in_titleline = self._in_age = False
+
+    def handle_data(self, data):
+        if self._capturing:
+            self._texts.append(data)
+
+    def _start_capture(self, field):
+        self._capturing = field
+        self._texts = []
+
+    def _finish_capture(self):
+        text = ''.join(self._texts)
+        words = text.split()
+        if self._capturing == 'title':
+            self._item['title'] = text
+        elif self._capturing == 'points':
+            # 形如 "123 points"
+            self._item['points'] = words[0] if words and words[0].isdigit() else '0'
+        elif words == ['discuss']:
+            # 还没有评论时，评论链接的文字为 "discuss"
+            self._item['comments_cnt'] = '0'
+        elif len(words) == 2 and words[0].isdigit() and words[1] in ('comment', 'comments'):
+            self._item['comments_cnt'] = words[0]
+        self._capturing = None
+
+    def close(self):
+        super().close()
+        self._finish_item()
+
+    def _finish_item(self):
+        if self._item and self._item['link']:
+            self.posts.append(Post(**self._item))
+        self._item = None
+
+
+def parse_hn_posts(text: str) -> List[Post]:
+    """解析整个页面，返回条目列表"""
+    parser = HNPostsParser()
+    parser.feed(text)
+    parser.close()
+    return parser.posts
+
+
+_SAMPLE_HN_ROWS = """
+<tr class="athing" id="1"><td class="title"><span class="titleline"><a href="https://github.com/a/b">Project B</a>
+<span class="sitebit comhead"> (<a href="from?site=github.com"><span class="sitestr">github.com</span></a>)</span></span></td></tr>
+<tr><td class="subtext"><span class="subline"><span class="score" id="score_1">120 points</span>
+by <a href="user?id=u1" class="hnuser">u1</a> <span class="age"><a href="item?id=1">3 hours ago</a></span>
+| <a href="hide?id=1&amp;goto=news">hide</a> | <a href="item?id=1">45&nbsp;comments</a></span></td></tr>
+<tr class="athing" id="2"><td class="title"><span class="titleline"><a href="item?id=2">Ask HN: Sample</a></span></td></tr>
+<tr><td class="subtext"><span class="subline"><span class="score" id="score_2">7 points</span>
+by <a href="user?id=u2" class="hnuser">u2</a> <span class="age"><a href="item?id=2">3 hours ago</a></span>
+| <a href="hide?id=2&amp;goto=news">hide</a> | <a href="item?id=2">discuss</a></span></td></tr>
+<tr class="athing" id="3"><td class="title"><span class="titleline"><a href="https://example.com/jobs">Example is hiring</a>
+</span></td></tr>
+<tr><td class="subtext"><span class="age"><a href="item?id=3">5 hours ago</a></span></td></tr>
+"""
+# 后两个条目没有评论：comments_cnt 为 0，而不是发布时间里的 3 和 5。招聘条目只有发布时间链接
+print([(post.title, post.points, post.comments_cnt) for post in parse_hn_posts(_SAMPLE_HN_ROWS)])
+
+
+class HTTPStatusError(Exception):
+    """服务端返回了错误的状态码"""
+
+    def __init__(self, status: int, url: str):
+        super().__init__(f'HTTP {status} for {url}')
+        self.status = status
+
+
+class AsyncTransport(ABC):
+    """抽象类：异步获取页面内容的传输层"""
+
+    @abstractmethod
+    async def get(self, url: str) -> str:
+        raise NotImplementedError()
+
+    async def close(self):
+        """释放传输层占用的资源"""
+
+
+class PooledHTTPTransport(AsyncTransport):
+    """基于 asyncio 的 HTTP/1.1 传输层，同一站点的请求复用 keep-alive 连接
+
+    :param max_connections_per_host: 每个站点最多同时打开的连接数
+    :param timeout: 单次请求的超时时间（秒）
+    """
+
+    def __init__(self, max_connections_per_host: int = 4, timeout: float = 10):
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+        self._idle = defaultdict(list)
+        self._limits: Dict[tuple, asyncio.Semaphore] = {}
+
+    async def get(self, url: str) -> str:
+        parts = parse.urlsplit(url)
+        use_ssl = parts.scheme == 'https'
+        port = parts.port or (443 if use_ssl else 80)
+        key = (parts.hostname, port, use_ssl)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+
+        limit = self._limits.setdefault(key, asyncio.Semaphore(self.max_connections_per_host))
+        async with limit:
+            while True:
+                reused = bool(self._idle[key])
+                if reused:
+                    reader, writer = self._idle[key].pop()
+                else:
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(parts.hostname, port, ssl=use_ssl or None), self.timeout
+                    )
+                try:
+                    status, body, keep_alive = await asyncio.wait_for(
+                        self._request(reader, writer, parts.netloc, target), self.timeout
+                    )
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    writer.close()
+                    # 空闲连接可能已被服务端关闭，换一个新连接重试
+                    if reused:
+                        continue
+                    raise
+                except BaseException:
+                    writer.close()
+                    raise
+                break
+
+            if keep_alive:
+                self._idle[key].append((reader, writer))
+            else:
+                writer.close()
+
+        if status >= 400:
+            raise HTTPStatusError(status, url)
+        return body.decode('utf-8', errors='replace')
+
+    @staticmethod
+    async def _request(reader, writer, host: str, target: str):
+        """发送 GET 请求并读取响应，返回 (状态码, 响应体, 能否复用连接)"""
+        writer.write(
+            f'GET {target} HTTP/1.1\r\nHost: {host}\r\nAccept-Encoding: identity\r\n'
+            f'Connection: keep-alive\r\n\r\n'.encode('latin-1')
+        )
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('connection closed by server')
+        version, status, *_ = status_line.decode('latin-1').split()
+        headers = {}
+        while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = bytearray()
+            while size := int((await reader.readline()).split(b';')[0], 16):
+                body += await reader.readexactly(size)
+                await reader.readexactly(2)
+            # 跳过可能存在的尾部字段
+            while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                pass
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return int(status), bytes(body), keep_alive
+
+    async def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+class HostRateLimiter:
+    """按站点限制请求频率
+
+    :param rate: 每个站点每秒最多发起的请求数，None 代表不限制
+    """
+
+    def __init__(self, rate: Optional[float]):
+        self.rate = rate
+        self._next_slot: Dict[str, float] = defaultdict(float)
+
+    async def wait(self, host: str):
+        if self.rate is None:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        # 事件循环是单线程的，读取与更新时间槽之间没有 await，无需加锁
+        slot = max(now, self._next_slot[host])
+        self._next_slot[host] = slot + 1 / self.rate
+        await asyncio.sleep(slot - now)
+
+
+class AsyncHNTopPostsSpider:
+    """并发抓取 Hacker News 多个页面的条目，每个页面一返回就解析并产出条目
+
+    :param limit: 限制条目数
+    :param pages: 抓取的页数
+    :param post_filter: 过滤结果条目的算法，默认保留所有
+    :param transport: 传输层，默认使用 PooledHTTPTransport
+    :param max_concurrency: 同时进行的请求数上限
+    :param rate_per_host: 每个站点每秒最多发起的请求数
+    :param retries: 请求失败后的重试次数，重试间隔按指数增长
+    :param backoff: 第一次重试前等待的秒数
+    """
+
+    items_url = 'https://news.ycombinator.com/news'
+
+    def __init__(
+        self,
+        limit: int = 30,
+        pages: int = 1,
+        post_filter: Optional[PostFilter] = None,
+        transport: Optional[AsyncTransport] = None,
+        max_concurrency: int = 8,
+        rate_per_host: Optional[float] = 2,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self.limit = limit
+        self.pages = pages
+        self.post_filter = post_filter or DefaultPostFilter()
+        self.transport = transport or PooledHTTPTransport()
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = HostRateLimiter(rate_per_host)
+        self.retries = retries
+        self.backoff = backoff
+
+    def get_page_urls(self) -> List[str]:
+        return [f'{self.items_url}?p={page}' for page in range(1, self.pages + 1)]
+
+    async def _get_with_retry(self, url: str) -> str:
+        host = parse.urlsplit(url).netloc
+        for attempt in range(self.retries + 1):
+            await self.rate_limiter.wait(host)
+            try:
+                return await self.transport.get(url)
+            except HTTPStatusError as exc:
+                # 客户端错误重试也没有用，只重试限流与服务端错误
+                if exc.status != 429 and exc.status < 500 or attempt == self.retries:
+                    raise
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    async def fetch(self) -> AsyncIterator[Post]:
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def fetch_page(url: str) -> List[Post]:
+            async with semaphore:
+                return parse_hn_posts(await self._get_with_retry(url))
+
+        tasks = [asyncio.ensure_future(fetch_page(url)) for url in self.get_page_urls()]
+        counter = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                for post in await next_done:
+                    if not self.post_filter.validate(post):
+                        continue
+                    yield post
+                    counter += 1
+                    if counter >= self.limit:
+                        return
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+async def get_hn_top_posts_async(fp=None, pages: int = 3):
+    """并发抓取多页 Hacker News 内容，并将其写入文件中"""
+    crawler = AsyncHNTopPostsSpider(pages=pages)
+    try:
+        posts = [post async for post in crawler.fetch()]
+    finally:
+        await crawler.transport.close()
+    PostsWriter(fp or sys.stdout, title='Top news on HN').write(posts)
+
+
+# 本地替身服务器：不访问真实的 Hacker News，也能验证连接复用、分块响应、失败重试与限流
+class _LocalHNHandler(BaseHTTPRequestHandler):
+    # 使用 HTTP/1.1，连接默认保持打开
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.connections += 1
+
+    def do_GET(self):
+        server = self.server
+        page = int(parse.parse_qs(parse.urlsplit(self.path).query).get('p', ['1'])[0])
+        with server.stats_lock:
+            server.request_times.append(time.monotonic())
+            server.failures_left[page] = failures = server.failures_left.get(page, server.fail_times) - 1
+        if failures >= 0:
+            self.send_response(503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        body = server.render_page(page).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for start in range(0, len(body), server.chunk_size):
+            chunk = body[start : start + server.chunk_size]
+            self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalHNServer(ThreadingHTTPServer):
+    """在后台线程中运行的 Hacker News 替身服务器，响应体总是使用分块传输编码
+
+    :param posts_per_page: 每页的条目数，每页最后一条是招聘条目，倒数第二条还没有评论
+    :param fail_times: 每个页面的前几次请求返回 503，用来验证重试
+    :param chunk_size: 响应体每块的字节数
+    """
+
+    daemon_threads = True
+
+    def __init__(self, posts_per_page: int = 30, fail_times: int = 1, chunk_size: int = 512):
+        super().__init__(('127.0.0.1', 0), _LocalHNHandler)
+        self.posts_per_page = posts_per_page
+        self.fail_times = fail_times
+        self.chunk_size = chunk_size
+        self.stats_lock = threading.Lock()
+        self.connections = 0
+        self.request_times: List[float] = []
+        self.failures_left: Dict[int, int] = {}
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def render_page(self, page: int) -> str:
+        rows = []
+        for i in range(self.posts_per_page):
+            item_id = page * 1000 + i
+            host = 'github.com' if i % 3 == 0 else 'example.com'
+            title = f'<tr class="athing" id="{item_id}"><td class="title"><span class="titleline">' \
+                    f'<a href="https://{host}/{item_id}">Post {item_id}</a></span></td></tr>'
+            age = f'<span class="age"><a href="item?id={item_id}">{i + 1} hours ago</a></span>'
+            if i == self.posts_per_page - 1:
+                subtext = age
+            else:
+                comments = 'discuss' if i == self.posts_per_page - 2 else f'{i}&nbsp;comments'
+                subtext = f'<span class="score">{i * 10} points</span> by <a href="user?id=u">u</a> {age} | ' \
+                          f'<a href="item?id={item_id}">{comments}</a>'
+            rows.append(f'{title}\n<tr><td class="subtext"><span class="subline">{subtext}</span></td></tr>')
+        return '<html><body><table>' + '\n'.join(rows) + '</table></body></html>'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def check_async_spider(pages: int = 3, rate_per_host: float = 20):
+    """用本地替身服务器运行 AsyncHNTopPostsSpider，打印抓取结果与服务器观察到的请求情况"""
+
+    async def run(server: LocalHNServer):
+        spider = AsyncHNTopPostsSpider(
+            limit=pages * server.posts_per_page, pages=pages, rate_per_host=rate_per_host, backoff=0.01,
+            transport=PooledHTTPTransport(max_connections_per_host=2),
+        )
+        spider.items_url = f'{server.url}/news'
+        try:
+            return [post async for post in spider.fetch()]
+        finally:
+            await spider.transport.close()
+
+    def expected_comments(post: Post) -> int:
+        i = int(post.link.rsplit('/', 1)[1]) % 1000
+        return i if i < server.posts_per_page - 2 else 0
+
+    with LocalHNServer() as server:
+        posts = asyncio.run(run(server))
+    intervals = [b - a for a, b in zip(server.request_times, server.request_times[1:])]
+    print(
+        f'posts={len(posts)} requests={len(server.request_times)} connections={server.connections} '
+        f'min_interval={min(intervals, default=0):.3f}s '
+        f'wrong_comments={sum(1 for post in posts if post.comments_cnt != expected_comments(post))}'
+    )
+
+
+check_async_spider()
@@ -41,43 +41,238 @@ class PagePerfLevel(str, Enum):
     GT_1000 = 'greater than 1000ms'
 
 # 继承
-from collections.abc import MutableMapping
-from collections import defaultdict
+import bisect
+from collections.abc import MutableMapping, Sequence
+from typing import Dict, Optional
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _as_float_array(values):
+    """把响应时间转换为 NumPy 数组。生成器等一次性迭代器没有长度，需要用 fromiter 逐个读取"""
+    if isinstance(values, (np.ndarray, Sequence)):
+        return np.asarray(values, dtype=float)
+    return np.fromiter(values, dtype=float)
+
+# 性能等级按顺序排列，每个等级在列表里的下标就是它在计数数组里的位置
+_PERF_LEVELS = list(PagePerfLevel)
+_PERF_LEVEL_INDEXES = {level: i for i, level in enumerate(_PERF_LEVELS)}
+# 各性能等级的响应时间上限（毫秒），最后一个等级没有上限
+_PERF_LEVEL_THRESHOLDS = [100, 300, 1000]
+
+
+def compute_level(latency) -> PagePerfLevel:
+    """根据响应时间（毫秒）计算性能等级"""
+    return _PERF_LEVELS[bisect.bisect_right(_PERF_LEVEL_THRESHOLDS, latency)]
+
 
 class PerfLevelDict(MutableMapping):
-    class PerfLevelDict(MutableMapping):
-        """存储响应时间性能等级的字典"""
+    """存储响应时间性能等级的字典
 
-        def __init__(self):
-            self.data = defaultdict(int)
+    键可以是性能等级，也可以是响应时间（会被转换为对应的等级）。
+    计数保存在按等级顺序排列的定长列表中，读写都是 O(1)。
+    """
 
-        def __getitem__(self, key):
-            """当某个性能等级不存在时，默认返回 0"""
-            return self.data[self.compute_level(key)]
+    def __init__(self):
+        self.counts = [0] * len(_PERF_LEVELS)
 
-        def __setitem__(self, key, value):
-            """将 key 转换为对应的性能等级，然后设置值"""
-            self.data[self.compute_level(key)] = value
+    @staticmethod
+    def _get_index(key) -> int:
+        if isinstance(key, PagePerfLevel):
+            return _PERF_LEVEL_INDEXES[key]
+        return bisect.bisect_right(_PERF_LEVEL_THRESHOLDS, key)
 
-        def __delitem__(self, key):
-            del self.data[key]
+    def __getitem__(self, key):
+        """当某个性能等级不存在时，默认返回 0"""
+        return self.counts[self._get_index(key)]
 
-        def __iter__(self):
-            return iter(self.data)
+    def __setitem__(self, key, value):
+        """将 key 转换为对应的性能等级，然后设置值"""
+        self.counts[self._get_index(key)] = value
 
-        def __len__(self):
-            return len(self.data)
+    def __delitem__(self, key):
+        self.counts[self._get_index(key)] = 0
 
-        def items(self):
-            """按照顺序返回性能等级数据"""
-            return sorted(
-                self.data.items(),
-                key=lambda pair: list(PagePerfLevel).index(pair[0]),
-            )
+    def __iter__(self):
+        """按照顺序返回计数不为 0 的性能等级"""
+        return (level for level, count in zip(_PERF_LEVELS, self.counts) if count)
+
+    def __len__(self):
+        return sum(1 for count in self.counts if count)
+
+    def add(self, latency, count: int = 1):
+        """记录一次响应时间"""
+        self.counts[bisect.bisect_right(_PERF_LEVEL_THRESHOLDS, latency)] += count
+
+    def add_many(self, latencies):
+        """批量记录多个响应时间，安装了 NumPy 时使用向量化计算"""
+        if np is not None:
+            indexes = np.searchsorted(_PERF_LEVEL_THRESHOLDS, _as_float_array(latencies), side='right')
+            for i, count in enumerate(np.bincount(indexes, minlength=len(_PERF_LEVELS))):
+                self.counts[i] += int(count)
+            return
+
+        counts = self.counts
+        bisect_right = bisect.bisect_right
+        for latency in latencies:
+            counts[bisect_right(_PERF_LEVEL_THRESHOLDS, latency)] += 1
+
+    def items(self):
+        """按照顺序返回性能等级数据，计数数组本身有序，无需排序"""
+        return [(level, count) for level, count in zip(_PERF_LEVELS, self.counts) if count]
+
+    def total_requests(self):
+        """返回总请求数"""
+        return sum(self.counts)
+
+
+perf_levels = PerfLevelDict()
+perf_levels.add_many([30, 120, 80, 900, 2000])
+print(perf_levels.items())
+
+# 只有 4 个性能等级的计数不够用时，可以用对数分桶的直方图估算分位数
+import math
+import time
+from collections import Counter
+
+
+class LatencyHistogram:
+    """对数分桶的响应时间直方图，用来估算 p50/p95/p99 等分位数
+
+    第 i 个桶保存 (gamma^(i-1), gamma^i] 区间内的样本数，估算值的相对误差不超过 precision。
+    桶的数量只与数值范围的对数相关，与样本数量无关；合并两个直方图只需把桶计数相加。
+
+    :param precision: 相对精度，默认 1%
+    """
+
+    def __init__(self, precision: float = 0.01):
+        self.precision = precision
+        self._gamma = (1 + precision) / (1 - precision)
+        self._log_gamma = math.log(self._gamma)
+        self.buckets = Counter()
+        # 小于等于 0 的样本无法取对数，单独计数
+        self.zero_count = 0
+        self.count = 0
 
-        def total_requests(self):
-            """返回总请求数"""
-            return sum(self.values())
+    def record(self, latency, count: int = 1):
+        """记录一次响应时间"""
+        if latency > 0:
+            self.buckets[math.ceil(math.log(latency) / self._log_gamma)] += count
+        else:
+            self.zero_count += count
+        self.count += count
+
+    def record_many(self, latencies):
+        """批量记录多个响应时间，安装了 NumPy 时使用向量化计算"""
+        if np is None:
+            for latency in latencies:
+                self.record(latency)
+            return
+
+        latencies = _as_float_array(latencies)
+        positive = latencies[latencies > 0]
+        indexes, counts = np.unique(np.ceil(np.log(positive) / self._log_gamma), return_counts=True)
+        self.buckets.update(dict(zip(indexes.astype(int).tolist(), counts.tolist())))
+        self.zero_count += len(latencies) - len(positive)
+        self.count += len(latencies)
+
+    def merge(self, other: 'LatencyHistogram'):
+        """把另一个直方图的数据合并到当前直方图，比如来自其他工作进程的直方图"""
+        if other.precision != self.precision:
+            raise ValueError('can not merge histograms with different precision')
+        self.buckets.update(other.buckets)
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def percentiles(self, qs=(50, 95, 99)) -> Dict[float, float]:
+        """一次遍历估算多个分位数
+
+        :param qs: 分位数列表，取值范围 0 到 100
+        :return: {分位数: 响应时间估算值}
+        """
+        if not self.count:
+            raise ValueError('histogram is empty')
+
+        results = {}
+        pending = sorted(qs)
+        cumulative = self.zero_count
+        while pending and pending[0] / 100 * (self.count - 1) < cumulative:
+            results[pending.pop(0)] = 0.0
+        for index in sorted(self.buckets):
+            cumulative += self.buckets[index]
+            while pending and pending[0] / 100 * (self.count - 1) < cumulative:
+                # 取桶区间的中间值，保证相对误差不超过 precision
+                results[pending.pop(0)] = 2 * self._gamma ** index / (self._gamma + 1)
+        return results
+
+    def percentile(self, q: float) -> float:
+        """估算单个分位数"""
+        return self.percentiles([q])[q]
+
+
+class RollingLatencyHistogram:
+    """滑动时间窗口内的响应时间直方图
+
+    窗口被切分为多个时间片，每个时间片对应一个直方图。过期的时间片会被整体丢弃，
+    不需要保存任何原始样本。时间戳可以乱序到达，早于当前窗口的样本会被直接丢弃。
+
+    :param window: 窗口长度（秒）
+    :param slots: 时间片数量，数量越多，窗口边界越精确
+    :param precision: 直方图的相对精度
+    :param clock: 获取当前时间的函数，多个进程间合并数据时应使用墙上时间
+    """
+
+    def __init__(self, window: float = 60, slots: int = 12, precision: float = 0.01, clock=time.time):
+        self.slot_seconds = window / slots
+        self.slots = slots
+        self.precision = precision
+        self.clock = clock
+        # {时间片编号: 直方图}，最多保存 slots 个时间片
+        self._histograms: Dict[int, LatencyHistogram] = {}
+        self._latest_slot = None
+
+    def _slot_id(self, now: Optional[float]) -> int:
+        return int((self.clock() if now is None else now) // self.slot_seconds)
+
+    def _advance(self, slot_id: int):
+        """窗口随着最新的时间片向前移动，删除移出窗口的时间片"""
+        if self._latest_slot is not None and slot_id <= self._latest_slot:
+            return
+        self._latest_slot = slot_id
+        for expired in [sid for sid in self._histograms if sid <= slot_id - self.slots]:
+            del self._histograms[expired]
+
+    def record(self, latency, now: Optional[float] = None):
+        """记录一次响应时间"""
+        slot_id = self._slot_id(now)
+        self._advance(slot_id)
+        if slot_id <= self._latest_slot - self.slots:
+            return
+        histogram = self._histograms.get(slot_id)
+        if histogram is None:
+            histogram = self._histograms[slot_id] = LatencyHistogram(self.precision)
+        histogram.record(latency)
+
+    def snapshot(self, now: Optional[float] = None) -> LatencyHistogram:
+        """返回当前窗口内所有数据合并后的直方图"""
+        slot_id = self._slot_id(now)
+        self._advance(slot_id)
+        merged = LatencyHistogram(self.precision)
+        for sid, histogram in self._histograms.items():
+            if slot_id - self.slots < sid <= slot_id:
+                merged.merge(histogram)
+        return merged
+
+    def percentiles(self, qs=(50, 95, 99), now: Optional[float] = None) -> Dict[float, float]:
+        return self.snapshot(now).percentiles(qs)
+
+
+histogram = LatencyHistogram()
+histogram.record_many([30, 120, 80, 900, 2000])
+print(histogram.percentiles())
 
 # 生成器
 def generate_even(max_number):
@@ -90,6 +285,55 @@ for i in generate_even(10):
 i = generate_even(10)
 print(f"{next(i)}, {next(i)}")
 
+# 需要处理大量整数时，按块返回结果，每块用步长或向量化掩码一次算出
+import array
+from itertools import compress
+from timeit import timeit
+
+
+def generate_even_chunks(max_number, chunk_size=65536):
+    """按块返回 0 到 max_number 之间的所有偶数
+
+    偶数是步长为 2 的等差数列，直接按步长生成，不需要对每个数取模。
+    安装了 NumPy 时每块是一个 NumPy 数组，否则是 array.array。
+
+    :param chunk_size: 每块最多包含的数字个数
+    """
+    span = chunk_size * 2
+    for start in range(0, max_number, span):
+        stop = min(start + span, max_number)
+        if np is not None:
+            yield np.arange(start, stop, 2, dtype=np.int64)
+        else:
+            yield array.array('q', range(start, stop, 2))
+
+
+def filter_range_chunks(start, stop, predicate, chunk_size=65536):
+    """按块返回 [start, stop) 区间内满足条件的整数
+
+    :param predicate: 判断函数，需要同时支持整数与 NumPy 数组，比如 lambda n: n % 3 == 0。
+        安装了 NumPy 时它会以整块数组为参数调用，返回布尔掩码
+    """
+    for chunk_start in range(start, stop, chunk_size):
+        chunk_stop = min(chunk_start + chunk_size, stop)
+        if np is not None:
+            numbers = np.arange(chunk_start, chunk_stop, dtype=np.int64)
+            yield numbers[predicate(numbers)]
+        else:
+            numbers = range(chunk_start, chunk_stop)
+            yield array.array('q', compress(numbers, map(predicate, numbers)))
+
+
+def bench_generate_even(max_number=10_000_000):
+    """对比逐个生成与按块生成偶数的吞吐量"""
+    def sum_chunks():
+        return sum(int(chunk.sum()) if np is not None else sum(chunk) for chunk in generate_even_chunks(max_number))
+
+    per_element = timeit(lambda: sum(generate_even(max_number)), number=1)
+    chunked = timeit(sum_chunks, number=1)
+    print(f'per element: {max_number / per_element / 1e6:.1f}M numbers/s')
+    print(f'chunked: {max_number / chunked / 1e6:.1f}M numbers/s')
+
 # 避开列表的性能陷阱
 # 列表头部插入数据
 from collections import deque
@@ -135,6 +379,149 @@ def latlon_to_address(lat, lon):
         city=city,
     )
 
+
+# 批量反向地理编码：坐标先对齐到网格，再依次查询内存 LRU、SQLite 缓存，最后才调用真正的解析服务
+import os
+import sqlite3
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Iterable, List, Tuple
+
+
+class AddressResolver(ABC):
+    """抽象类：把坐标解析为地址的服务"""
+
+    @abstractmethod
+    def resolve_many(self, coords: List[Tuple[float, float]]) -> List[Address]:
+        """批量解析坐标，返回顺序与 coords 一致"""
+        raise NotImplementedError()
+
+
+class LocalAddressResolver(AddressResolver):
+    """本地解析服务，逐个调用 latlon_to_address，用于替代真实的远程服务"""
+
+    def resolve_many(self, coords: List[Tuple[float, float]]) -> List[Address]:
+        return [latlon_to_address(lat, lon) for lat, lon in coords]
+
+
+class SQLiteAddressCache:
+    """保存在 SQLite 中的地址缓存，进程重启后依然有效
+
+    :param path: 数据库文件路径
+    """
+
+    max_query_params = 500
+
+    def __init__(self, path: str):
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS addresses '
+            '(grid_key TEXT PRIMARY KEY, country, province, city)'
+        )
+
+    def get_many(self, keys: List[str]) -> Dict[str, Address]:
+        found = {}
+        for i in range(0, len(keys), self.max_query_params):
+            batch = keys[i : i + self.max_query_params]
+            placeholders = ','.join('?' * len(batch))
+            rows = self.conn.execute(
+                f'SELECT * FROM addresses WHERE grid_key IN ({placeholders})', batch
+            )
+            found.update((key, Address(*fields)) for key, *fields in rows)
+        return found
+
+    def put_many(self, items: Dict[str, Address]):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO addresses VALUES (?, ?, ?, ?)',
+                ((key, *address) for key, address in items.items()),
+            )
+
+
+class CachedGeocoder:
+    """带两级缓存的批量反向地理编码器
+
+    坐标会按 precision 位小数对齐到网格上，落在同一个格子里的坐标共用一个地址。
+
+    :param resolver: 缓存未命中时使用的解析服务
+    :param disk_cache: 持久化缓存，默认保存在临时目录下的 addresses.db 文件中
+    :param precision: 网格精度（小数位数），3 位约等于 100 米
+    :param maxsize: 内存缓存最多保存的格子数量
+    """
+
+    def __init__(
+        self,
+        resolver: AddressResolver,
+        disk_cache: Optional[SQLiteAddressCache] = None,
+        precision: int = 3,
+        maxsize: int = 100_000,
+    ):
+        self.resolver = resolver
+        self.disk_cache = disk_cache or SQLiteAddressCache(os.path.join(tempfile.gettempdir(), 'addresses.db'))
+        self.precision = precision
+        self.maxsize = maxsize
+        self._memory_cache = OrderedDict()
+        self.stats = Counter()
+
+    def _grid_key(self, lat, lon) -> str:
+        scale = 10 ** self.precision
+        # 键里带上精度，不同精度的编码器共用一个缓存文件时不会互相干扰
+        return f'{self.precision}:{round(float(lat) * scale)}:{round(float(lon) * scale)}'
+
+    def _grid_center(self, key: str) -> Tuple[float, float]:
+        scale = 10 ** self.precision
+        _, lat, lon = key.split(':')
+        return int(lat) / scale, int(lon) / scale
+
+    def _remember(self, key: str, address: Address):
+        self._memory_cache[key] = address
+        if len(self._memory_cache) > self.maxsize:
+            self._memory_cache.popitem(last=False)
+
+    def lookup_many(self, coords: Iterable[Tuple[float, float]]) -> List[Address]:
+        """批量查询地址
+
+        :param coords: 由 (纬度, 经度) 组成的可迭代对象，也可以是形状为 (n, 2) 的 NumPy 数组
+        """
+        keys = [self._grid_key(lat, lon) for lat, lon in coords]
+        found = {}
+        missing = []
+        # 同一批里的重复格子只查询一次
+        for key in dict.fromkeys(keys):
+            address = self._memory_cache.get(key)
+            if address is None:
+                missing.append(key)
+            else:
+                self._memory_cache.move_to_end(key)
+                found[key] = address
+        self.stats['memory_hits'] += len(found)
+
+        if missing:
+            from_disk = self.disk_cache.get_many(missing)
+            self.stats['disk_hits'] += len(from_disk)
+            missing = [key for key in missing if key not in from_disk]
+
+            resolved = {}
+            if missing:
+                addresses = self.resolver.resolve_many([self._grid_center(key) for key in missing])
+                resolved = dict(zip(missing, addresses))
+                self.disk_cache.put_many(resolved)
+                self.stats['resolved'] += len(resolved)
+
+            for key, address in {**from_disk, **resolved}.items():
+                self._remember(key, address)
+                found[key] = address
+
+        return [found[key] for key in keys]
+
+    def lookup(self, lat, lon) -> Address:
+        """查询单个坐标的地址"""
+        return self.lookup_many([(lat, lon)])[0]
+
+
+geocoder = CachedGeocoder(LocalAddressResolver())
+print(geocoder.lookup_many([(39.9042, 116.4074), (39.90421, 116.40739)]))
+
 """
 （1）基础知识· 在进行函数调用时，传递的不是变量的值或者引用，而是变量所指对象的引用· Python内置类型分为可变与不可变两种，可变性会影响一些操作的行为，比如+=· 
 对于可变类型，必要时对其进行拷贝操作，能避免产生意料之外的影响· 常见的浅拷贝方式：copy.copy、推导式、切片操作· 使用copy.deepcopy可以进行深拷贝操作
@@ -17,6 +17,124 @@ users = UserCollection(['piglei', 'raymond'])
 if users:
     print("There's some users in collection!")
 
+# 数据来自大文件或分页接口时，可以让集合按需加载，判断真假时只读取第一个成员
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, count, islice
+
+
+class LazyUserCollection:
+    """按需加载用户的集合工具类
+
+    :param source: 用户数据源。可以是每次调用都返回新迭代器的函数（比如逐行读取文件的生成器函数），
+        也可以是列表等可迭代对象，或者只能遍历一次的迭代器
+    :param total: 已知的用户总数，未知时为 None
+    :param chunk_size: 每次从数据源读取的用户数，内存中最多缓冲这么多用户
+    :param chunks_factory: 代替 source，每次调用都返回一个新的“用户列表”迭代器，每个列表就是一块数据
+    :param prefetch: 遍历时在后台线程中提前读取的块数，为 0 时只在需要时读取。
+        预读能让加载与处理重叠进行，但提前返回的遍历可能多加载几块数据
+    """
+
+    def __init__(self, source=None, total=None, chunk_size=1000, *, chunks_factory=None, prefetch=0):
+        if chunks_factory is not None:
+            self._chunks_factory = chunks_factory
+            self._reiterable = True
+        elif callable(source):
+            self._chunks_factory = lambda: self._split_chunks(source(), chunk_size)
+            self._reiterable = True
+        else:
+            self._chunks_factory = lambda: self._split_chunks(iter(source), chunk_size)
+            # 迭代器只能遍历一次，列表等容器则可以反复遍历
+            self._reiterable = iter(source) is not source
+        self._total = total
+        self._prefetch = prefetch
+        # __bool__ 读取的第一块数据，以及读取它的迭代器，下一次遍历会接着使用，避免重复加载
+        self._pending = None
+
+    @staticmethod
+    def _split_chunks(iterator, chunk_size):
+        while chunk := list(islice(iterator, chunk_size)):
+            yield chunk
+
+    @staticmethod
+    def _prefetched(chunks, size):
+        """在后台线程中提前读取最多 size 块数据，内存中最多缓冲 size + 1 块"""
+        with ThreadPoolExecutor(1) as executor:
+            pending = deque(executor.submit(next, chunks, None) for _ in range(size))
+            try:
+                while (chunk := pending.popleft().result()) is not None:
+                    pending.append(executor.submit(next, chunks, None))
+                    yield chunk
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    @classmethod
+    def from_pages(cls, load_page, total=None):
+        """基于分页加载函数创建集合，每一页就是一块数据
+
+        :param load_page: 接收页码（从 0 开始），返回该页的用户列表，空列表代表没有更多数据
+        """
+
+        def iter_pages():
+            for page in count():
+                users = load_page(page)
+                if not users:
+                    return
+                yield users
+
+        return cls(total=total, chunks_factory=iter_pages)
+
+    def _iter_raw_chunks(self):
+        if self._pending is not None:
+            first_chunk, chunks = self._pending
+            self._pending = None
+            chunks = chain([first_chunk], chunks)
+        else:
+            chunks = self._chunks_factory()
+        return self._prefetched(chunks, self._prefetch) if self._prefetch else chunks
+
+    def iter_chunks(self):
+        """按块返回用户列表"""
+        counted = 0
+        for chunk in self._iter_raw_chunks():
+            counted += len(chunk)
+            yield chunk
+        # 完整遍历过一次后，记住总数
+        if self._reiterable:
+            self._total = counted
+
+    def __iter__(self):
+        for chunk in self.iter_chunks():
+            yield from chunk
+
+    def __bool__(self):
+        """只需要读取第一块数据，读到的数据会留给下一次遍历使用"""
+        if self._total is not None:
+            return self._total > 0
+        if self._pending is None:
+            chunks = self._chunks_factory()
+            first_chunk = next(chunks, None)
+            if first_chunk is None:
+                return False
+            self._pending = (first_chunk, chunks)
+        return True
+
+    def __len__(self):
+        """返回已知的总数。总数未知时抛出 TypeError，避免 list() 等调用为了获取长度而多遍历一次数据"""
+        if self._total is None:
+            raise TypeError('total is unknown, call count() or iterate over the collection first')
+        return self._total
+
+    def count(self):
+        """返回用户总数，总数未知时遍历一次数据源并缓存结果"""
+        if self._total is None:
+            if not self._reiterable:
+                raise TypeError('can not count a one-shot iterator without consuming it')
+            for _ in self.iter_chunks():
+                pass
+        return self._total
+
 class ScoreJudger:
     """仅当分数大于60 时为真"""
 
@@ -45,6 +163,63 @@ x is y #true
 
 # bisect(a, x, lo=0, hi=len(a))：在a中查找x，返回x在a中的位置，如果a中存在多个x，则返回任意一个x的位置。如果x不在a中，则返回应该插入x的位置。
 
+import bisect
+from collections.abc import Sequence
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class RangeDispatcher:
+    """按数值区间分派标签，用二分查找替代一长串 if/elif 范围判断
+
+    分界点本身属于右侧区间，比如分界点为 [60] 时，60 分对应第二个标签。
+
+    :param breakpoints: 升序排列的区间分界点，比如 [60, 70, 80, 90]
+    :param labels: 各区间的标签，数量比分界点多一个，比如 'EDCBA'
+    """
+
+    def __init__(self, breakpoints, labels):
+        self.breakpoints = list(breakpoints)
+        self.labels = list(labels)
+        if len(self.labels) != len(self.breakpoints) + 1:
+            raise ValueError('the number of labels must be one more than breakpoints')
+        if any(a >= b for a, b in zip(self.breakpoints, self.breakpoints[1:])):
+            raise ValueError('breakpoints must be in strictly ascending order')
+
+    def classify(self, value):
+        """返回单个值的标签，时间复杂度 O(log n)"""
+        return self.labels[bisect.bisect_right(self.breakpoints, value)]
+
+    __call__ = classify
+
+    def classify_many(self, values) -> list:
+        """批量返回多个值的标签，结果顺序与 values 一致
+
+        安装了 NumPy 时使用 numpy.searchsorted，否则先对输入排序，再与分界点一起顺序遍历一次。
+        """
+        if np is not None:
+            # np.asarray 不接受生成器，先把一次性迭代器展开为列表
+            if not isinstance(values, (np.ndarray, Sequence)):
+                values = list(values)
+            indexes = np.searchsorted(self.breakpoints, np.asarray(values), side='right')
+            return [self.labels[i] for i in indexes.tolist()]
+
+        values = list(values)
+        results = [None] * len(values)
+        level = 0
+        for i in sorted(range(len(values)), key=values.__getitem__):
+            while level < len(self.breakpoints) and values[i] >= self.breakpoints[level]:
+                level += 1
+            results[i] = self.labels[level]
+        return results
+
+
+grade_dispatcher = RangeDispatcher([60, 70, 80, 90], 'EDCBA')
+print(grade_dispatcher(59), grade_dispatcher(60), grade_dispatcher.classify_many([95, 72, 30]))
+
 # 使用all()/any()函数构建条件表达式
 def all_numbers(numbers):
     if not numbers:
@@ -57,6 +232,16 @@ def all_numbers(numbers):
 def all_numbers1(numbers):
     return bool(numbers) and all(n > 10 for n in numbers)
 
+
+def _load_numbers_page(page):
+    print(f'loading page {page}')
+    return [[12, 15], [3, 40], [50, 60]][page] if page < 3 else []
+
+
+lazy_numbers = LazyUserCollection.from_pages(_load_numbers_page)
+# all_numbers1 在第 1 页读到 3 时就会返回，不会再加载后面的页
+print(all_numbers1(lazy_numbers))
+
 """
 （1）条件分支语句惯用写法· 不要显式地和布尔值做比较· 利用类型本身的布尔值规则，省略零值判断· 把not代表的否定逻辑移入表达式内部· 
 仅在需要判断某个对象是否是None、True、False时，使用is运算符
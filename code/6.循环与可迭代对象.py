@@ -13,6 +13,95 @@ print(next(i for i in numbers if i % 7 == 0))
 my_list = [1, 2, 3]  # 可迭代对象
 my_iterator = iter(my_list)  # 迭代器
 print(next(my_iterator))
+# 读取大文件：按固定大小分块读取，不依赖换行符
+import mmap
+import os
+import tempfile
+from functools import partial
+from timeit import timeit
+
+
+def iter_blocks(fp, block_size=1024 * 1024):
+    """按固定大小分块读取文件，文本与二进制模式都适用"""
+    # fp.read(0) 会返回与文件模式匹配的空值：'' 或 b''，正好用作哨兵
+    return iter(partial(fp.read, block_size), fp.read(0))
+
+
+def iter_mmap_blocks(path, block_size=1024 * 1024):
+    """通过 mmap 分块读取文件，返回 memoryview 切片，不会复制数据
+
+    切片直接引用映射的内存，生成器结束后即失效，需要保留数据时请调用 bytes() 复制。
+    """
+    with open(path, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0:
+            return
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                for start in range(0, len(mm), block_size):
+                    block = view[start : start + block_size]
+                    # 调用方提前结束遍历时，也要先释放切片，否则 mmap 无法关闭
+                    try:
+                        yield block
+                    finally:
+                        block.release()
+            finally:
+                view.release()
+
+
+def iter_records(fp, delimiter, block_size=1024 * 1024):
+    """按自定义分隔符切分文件里的记录
+
+    记录或分隔符跨越两个块时也能正确处理。未结束的记录以片段列表的形式暂存，
+    最后只拼接一次，超长记录不会导致反复复制。
+    """
+    empty = fp.read(0)
+    overlap = len(delimiter) - 1
+    pending = []
+    for block in iter_blocks(fp, block_size):
+        if pending and overlap:
+            # 把上个片段末尾的几个字符挪到当前块，避免分隔符被块边界切断
+            block = pending[-1][-overlap:] + block
+            pending[-1] = pending[-1][:-overlap]
+
+        records = block.split(delimiter)
+        if len(records) == 1:
+            pending.append(block)
+            continue
+
+        pending.append(records[0])
+        yield empty.join(pending)
+        yield from records[1:-1]
+        pending = [records[-1]]
+
+    last_record = empty.join(pending)
+    if last_record:
+        yield last_record
+
+
+def bench_read_file(size=50 * 1024 * 1024):
+    """在一个没有换行符的大文件上，对比逐行读取与分块读取的耗时"""
+    with tempfile.NamedTemporaryFile(delete=False) as fp:
+        fp.write(b'0123456789' * (size // 10))
+        path = fp.name
+
+    def count_by_lines():
+        with open(path, 'rb') as fp:
+            return sum(line.count(b'9') for line in fp)
+
+    def count_by_blocks():
+        with open(path, 'rb') as fp:
+            return sum(block.count(b'9') for block in iter_blocks(fp))
+
+    def count_by_mmap():
+        return sum(bytes(block).count(b'9') for block in iter_mmap_blocks(path))
+
+    try:
+        for func in (count_by_lines, count_by_blocks, count_by_mmap):
+            print(f'{func.__name__}: {timeit(func, number=1):.3f}s')
+    finally:
+        os.remove(path)
+
 """
 （1）迭代与迭代器原理· 使用iter()函数会尝试获取一个迭代器对象· 使用next()函数会获取迭代器的下一个内容· 
 可以将for循环简单地理解为while循环+不断调用next()· 自定义迭代器需要实现__iter__和__next__两个魔法方法· 
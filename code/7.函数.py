@@ -1,6 +1,18 @@
 import functools
+import hashlib
+import heapq
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
 import time
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
 from operator import itemgetter
+from timeit import timeit
+from typing import Any, Dict, NamedTuple
 
 # 常用函数模块：functools
 # 01．functools.partial()
@@ -24,6 +36,268 @@ def calculate_score1(class_id):
     time.sleep(12)
     return 42
 
+# lru_cache 只在当前进程内有效，也不会过期。下面的缓存支持过期时间、按字节数限制容量，
+# 并且可以把结果保存在多个进程共享的 SQLite 文件中
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize max_bytes currbytes')
+
+
+class _CacheEntry(NamedTuple):
+    value: Any
+    expires_at: float
+    size: int
+
+
+class PersistentCache:
+    """带过期时间的两级缓存：进程内的 LRU 缓存 + 可选的 SQLite 共享缓存
+
+    同一个键同时未命中时，只有一个调用方会真正执行函数，其他调用方等待结果。
+    使用共享缓存时，这一点在多个进程之间同样成立。多个函数可以共用同一个 SQLite 文件，
+    每条记录都带有函数名，清空缓存时只会删除当前函数的结果。
+
+    :param func: 被缓存的函数，参数与返回值都需要支持 pickle
+    :param ttl: 缓存有效期（秒），None 代表永不过期
+    :param maxsize: 内存中最多保存的结果数量，None 代表不限制
+    :param max_bytes: 内存中结果的总字节数上限（按 pickle 后的大小计算），None 代表不限制
+    :param path: 共享缓存的 SQLite 文件路径，None 代表只使用内存缓存
+    :param lock_timeout: 其他进程计算同一个键时，最多等待多少秒
+    :param max_disk_bytes: 共享文件中所有函数结果的总字节数上限，超出时淘汰最早写入的结果。
+        清理是定期进行的，文件大小可能短暂超出上限。None 代表只清理过期结果，不限制大小
+    """
+
+    def __init__(
+        self, func, ttl=None, maxsize=128, max_bytes=None, path=None, lock_timeout=60, max_disk_bytes=None
+    ):
+        self.func = func
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.path = path
+        self.lock_timeout = lock_timeout
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self._current_bytes = 0
+        self._hits = self._misses = 0
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        # SQLite 连接不能跨线程使用，每个线程单独创建
+        self._local = threading.local()
+        self._func_name = f'{func.__module__}.{func.__qualname__}'
+        self._last_purge = 0.0
+        self._written_bytes = 0
+
+    def __call__(self, *args, **kwargs):
+        key = self._make_key(args, kwargs)
+        found, value = self._get(key)
+        if found:
+            return value
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = self._in_flight[key] = Future()
+        if not is_owner:
+            value = future.result()
+            # 与 lru_cache 一致，等待其他调用方算出的结果也算作命中
+            with self._lock:
+                self._hits += 1
+            return value
+
+        try:
+            # 注册前可能刚好有其他线程写入了结果，再检查一次
+            found, value = self._get(key)
+            if not found:
+                value = self._compute(key, args, kwargs)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _make_key(self, args, kwargs) -> str:
+        raw = pickle.dumps((args, sorted(kwargs.items())))
+        return hashlib.sha256(raw).hexdigest()
+
+    def _get(self, key):
+        """依次查询内存与共享缓存，返回 (是否命中, 结果)"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return True, entry.value
+                self._remove(key)
+
+        if self.path is not None:
+            row = self._get_conn().execute(
+                'SELECT value, expires_at FROM results WHERE func = ? AND key = ? AND expires_at > ?',
+                (self._func_name, key, now),
+            ).fetchone()
+            if row is not None:
+                blob, expires_at = row
+                value = pickle.loads(blob)
+                with self._lock:
+                    self._hits += 1
+                    self._put_memory(key, _CacheEntry(value, expires_at, len(blob)))
+                return True, value
+        return False, None
+
+    def _compute(self, key, args, kwargs):
+        if self.path is None:
+            return self._compute_and_store(key, args, kwargs)
+
+        deadline = time.time() + self.lock_timeout
+        while not (locked := self._try_lock(key)):
+            # 其他进程正在计算，等待它把结果写入共享缓存
+            time.sleep(0.05)
+            found, value = self._get(key)
+            if found:
+                return value
+            if time.time() > deadline:
+                # 等待超时后自行计算，但锁仍属于其他进程，不能删除
+                break
+        try:
+            return self._compute_and_store(key, args, kwargs)
+        finally:
+            if locked:
+                with self._get_conn() as conn:
+                    conn.execute('DELETE FROM locks WHERE func = ? AND key = ?', (self._func_name, key))
+
+    def _compute_and_store(self, key, args, kwargs):
+        value = self.func(*args, **kwargs)
+        expires_at = time.time() + self.ttl if self.ttl is not None else float('inf')
+        blob = pickle.dumps(value)
+        with self._lock:
+            self._misses += 1
+            self._put_memory(key, _CacheEntry(value, expires_at, len(blob)))
+        if self.path is not None:
+            with self._get_conn() as conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                    (self._func_name, key, blob, len(blob), expires_at),
+                )
+            self._written_bytes += len(blob)
+            self._purge()
+        return value
+
+    # 两次清理过期记录之间的最短间隔（秒）
+    purge_interval = 60
+
+    def _purge(self):
+        """定期删除共享文件中所有函数已过期的结果与锁，并把结果的总大小控制在 max_disk_bytes 以内
+
+        写入量超过上限的十分之一时会提前清理，避免大量写入时文件远超上限。
+        """
+        now = time.time()
+        written_too_much = self.max_disk_bytes is not None and self._written_bytes > self.max_disk_bytes / 10
+        if now - self._last_purge < self.purge_interval and not written_too_much:
+            return
+        self._last_purge = now
+        self._written_bytes = 0
+        with self._get_conn() as conn:
+            conn.execute('DELETE FROM results WHERE expires_at <= ?', (now,))
+            conn.execute('DELETE FROM locks WHERE expires_at < ?', (now,))
+            if self.max_disk_bytes is not None:
+                # INSERT OR REPLACE 总会分配新的 rowid，按 rowid 从新到旧累加大小，删除超出上限的部分
+                conn.execute(
+                    'DELETE FROM results WHERE rowid IN (SELECT rowid FROM '
+                    '(SELECT rowid, SUM(size) OVER (ORDER BY rowid DESC) AS total FROM results) WHERE total > ?)',
+                    (self.max_disk_bytes,),
+                )
+
+    def _put_memory(self, key, entry: _CacheEntry):
+        """写入内存缓存，超出容量时淘汰最久未使用的结果，调用方需持有锁"""
+        if self.max_bytes is not None and entry.size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        self._current_bytes += entry.size
+        while (self.maxsize is not None and len(self._entries) > self.maxsize) or (
+            self.max_bytes is not None and self._current_bytes > self.max_bytes
+        ):
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        self._current_bytes -= self._entries.pop(key).size
+
+    def _get_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS results '
+                '(func TEXT, key TEXT, value BLOB, size INTEGER, expires_at REAL, PRIMARY KEY (func, key))'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS results_expires_at ON results (expires_at)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS locks (func TEXT, key TEXT, expires_at REAL, PRIMARY KEY (func, key))'
+            )
+        return conn
+
+    def _try_lock(self, key) -> bool:
+        """尝试获取某个键的跨进程计算锁，锁会在 lock_timeout 秒后自动失效"""
+        now = time.time()
+        with self._get_conn() as conn:
+            conn.execute(
+                'DELETE FROM locks WHERE func = ? AND key = ? AND expires_at < ?', (self._func_name, key, now)
+            )
+            cursor = conn.execute(
+                'INSERT OR IGNORE INTO locks VALUES (?, ?, ?)', (self._func_name, key, now + self.lock_timeout)
+            )
+        return cursor.rowcount == 1
+
+    def cache_info(self) -> CacheInfo:
+        with self._lock:
+            return CacheInfo(
+                self._hits, self._misses, self.maxsize, len(self._entries), self.max_bytes, self._current_bytes
+            )
+
+    def cache_clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._current_bytes = 0
+            self._hits = self._misses = 0
+        if self.path is not None:
+            with self._get_conn() as conn:
+                conn.execute('DELETE FROM results WHERE func = ?', (self._func_name,))
+
+
+def persistent_cache(ttl=None, maxsize=128, max_bytes=None, path=None, lock_timeout=60, max_disk_bytes=None):
+    """装饰器：为函数添加带过期时间的缓存，参数含义见 PersistentCache
+
+    与 lru_cache 一样，可以通过 func.cache_info() 与 func.cache_clear() 查看和清空缓存。
+    """
+
+    def decorator(func):
+        cache = PersistentCache(func, ttl, maxsize, max_bytes, path, lock_timeout, max_disk_bytes)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return cache(*args, **kwargs)
+
+        wrapper.cache_info = cache.cache_info
+        wrapper.cache_clear = cache.cache_clear
+        return wrapper
+
+    return decorator
+
+
+@persistent_cache(ttl=3600, max_bytes=10 * 1024 * 1024, path=os.path.join(tempfile.gettempdir(), 'scores.db'))
+def calculate_score2(class_id):
+    print(f'calculating {class_id}')
+    time.sleep(12)
+    return 42
+
+
 data = [1,2,3,4,5]
 b = itemgetter(0,1,2)
 print(b(data))
@@ -34,6 +308,82 @@ data = [
 data = sorted(data, key=itemgetter("age"))
 print(data)
 
+
+# 数据无法全部放入内存时，使用外部归并排序：分段排序后写入临时文件，再用 heapq.merge 归并
+def _write_sorted_run(records, key, dir_path) -> str:
+    """对一段记录排序并写入临时文件，返回文件路径"""
+    return _write_run(sorted(records, key=key), dir_path)
+
+
+def _write_run(records, dir_path) -> str:
+    """把已经有序的记录写入临时文件，返回文件路径"""
+    fd, path = tempfile.mkstemp(suffix='.run', dir=dir_path)
+    with os.fdopen(fd, 'wb') as fp:
+        pickler = pickle.Pickler(fp, protocol=pickle.HIGHEST_PROTOCOL)
+        for record in records:
+            pickler.dump(record)
+            # 每条记录都是独立对象，清空备忘表避免它随记录数增长
+            pickler.clear_memo()
+    return path
+
+
+def _read_run(path):
+    with open(path, 'rb') as fp:
+        unpickler = pickle.Unpickler(fp)
+        while True:
+            try:
+                yield unpickler.load()
+            except EOFError:
+                return
+
+
+def _merge_runs(run_paths, key):
+    # heapq.merge 在键相同时会优先返回靠前的输入，分段按原始顺序排列，所以排序是稳定的
+    return heapq.merge(*(_read_run(path) for path in run_paths), key=key)
+
+
+def external_sorted(records, key=None, max_in_memory=100_000, workers=0, max_fan_in=64):
+    """外部归并排序，返回有序记录的迭代器，相同键的记录保持原有顺序
+
+    :param records: 字典或元组的可迭代对象，记录需要支持 pickle
+    :param key: 排序键，比如 itemgetter("age")，并行排序时也需要支持 pickle
+    :param max_in_memory: 每段最多读入内存的记录数，用来控制内存占用
+    :param workers: 大于 0 时，使用该数量的进程并行排序各个分段
+    :param max_fan_in: 每次归并最多同时打开的分段文件数，分段更多时先分多轮归并为较大的分段
+    """
+    if max_fan_in < 2:
+        raise ValueError('max_fan_in must be at least 2')
+    records = iter(records)
+    with tempfile.TemporaryDirectory(prefix='external-sort-') as dir_path:
+        chunks = iter(lambda: list(islice(records, max_in_memory)), [])
+        if workers > 0:
+            run_paths = []
+            with ProcessPoolExecutor(workers) as executor:
+                # 限制同时提交的分段数量，避免读入过多数据
+                pending = deque()
+                for chunk in chunks:
+                    if len(pending) >= workers:
+                        run_paths.append(pending.popleft().result())
+                    pending.append(executor.submit(_write_sorted_run, chunk, key, dir_path))
+                run_paths.extend(future.result() for future in pending)
+        else:
+            run_paths = [_write_sorted_run(chunk, key, dir_path) for chunk in chunks]
+
+        while len(run_paths) > max_fan_in:
+            # 相邻的分段归并在一起，新分段依然按原始顺序排列，保证下一轮归并也是稳定的
+            merged_paths = []
+            for i in range(0, len(run_paths), max_fan_in):
+                group = run_paths[i : i + max_fan_in]
+                if len(group) == 1:
+                    merged_paths.append(group[0])
+                    continue
+                merged_paths.append(_write_run(_merge_runs(group, key), dir_path))
+                for path in group:
+                    os.remove(path)
+            run_paths = merged_paths
+
+        yield from _merge_runs(run_paths, key)
+
 # 递归
 def fib(n):
     if n < 2:
@@ -47,6 +397,87 @@ def fib_loop(n):
         a, b = b, a+b
     return a
 
+# 快速倍增：F(2k) = F(k) * (2F(k+1) - F(k))，F(2k+1) = F(k)^2 + F(k+1)^2，只需 O(log n) 次乘法
+def _fib_pair(n):
+    """返回 (F(n), F(n+1))"""
+    if n == 0:
+        return 0, 1
+    a, b = _fib_pair(n >> 1)
+    c = a * (2 * b - a)
+    d = a * a + b * b
+    return (d, c + d) if n & 1 else (c, d)
+
+
+def fib_fast(n):
+    """使用快速倍增法计算第 n 个斐波那契数"""
+    if n < 0:
+        raise ValueError('n must be a non-negative integer')
+    return _fib_pair(n)[0]
+
+
+def fib_many(indexes):
+    """批量计算多个斐波那契数，返回 {n: F(n)}
+
+    按从小到大的顺序计算，每个结果都从上一个结果出发，只需补上两者之间的差距：
+    F(m+n) = F(m) * F(n+1) + F(m+1) * F(n) - F(m) * F(n)
+    """
+    results = {}
+    n, f_n, f_n1 = 0, 0, 1
+    for target in sorted(set(indexes)):
+        if target < 0:
+            raise ValueError('n must be a non-negative integer')
+        f_m, f_m1 = _fib_pair(target - n)
+        f_n, f_n1 = f_n * (f_m1 - f_m) + f_n1 * f_m, f_n * f_m + f_n1 * f_m1
+        n = target
+        results[target] = f_n
+    return results
+
+
+def _mat_mul(x, y):
+    size = len(x)
+    return [
+        [sum(x[i][k] * y[k][j] for k in range(size)) for j in range(size)]
+        for i in range(size)
+    ]
+
+
+def linear_recurrence(coefficients, initial, n):
+    """使用矩阵快速幂计算线性递推数列的第 n 项
+
+    数列满足 a(n) = c1 * a(n-1) + c2 * a(n-2) + ... + ck * a(n-k)
+
+    :param coefficients: 递推系数 [c1, c2, ..., ck]
+    :param initial: 前 k 项 [a(0), a(1), ..., a(k-1)]
+    """
+    k = len(coefficients)
+    if len(initial) != k:
+        raise ValueError('initial must have the same length as coefficients')
+    if n < 0:
+        raise ValueError('n must be a non-negative integer')
+    if n < k:
+        return initial[n]
+
+    # 转移矩阵：第一行是递推系数，其余行把状态向量整体下移一位
+    matrix = [list(coefficients)] + [[int(i == j) for j in range(k)] for i in range(k - 1)]
+    result = [[int(i == j) for j in range(k)] for i in range(k)]
+    power = n - k + 1
+    while power:
+        if power & 1:
+            result = _mat_mul(result, matrix)
+        matrix = _mat_mul(matrix, matrix)
+        power >>= 1
+    # 状态向量为 [a(k-1), a(k-2), ..., a(0)]
+    state = initial[::-1]
+    return sum(x * y for x, y in zip(result[0], state))
+
+
+def bench_fib(ns=(20, 25, 1000, 100_000)):
+    """对比递归、循环、快速倍增三种算法在不同 n 下的耗时，递归版本只测试较小的 n"""
+    for n in ns:
+        funcs = [fib_loop, fib_fast] if n > 25 else [fib, fib_loop, fib_fast]
+        costs = ', '.join(f'{func.__name__}: {timeit(lambda: func(n), number=1):.4f}s' for func in funcs)
+        print(f'n={n}: {costs}')
+
 print(calculate_score1.cache_info())
 
 
@@ -1,6 +1,22 @@
+import asyncio
 import functools
+import heapq
+import inspect
+import itertools
+import json
+import random
+import threading
 import time
+import weakref
+from collections import Counter, OrderedDict, defaultdict, deque, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 from functools import wraps
+from operator import itemgetter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 @functools.lru_cache
@@ -53,7 +69,7 @@ def calls_counter(func):
     def print_counter():
         print(f'Counter: {counter}')
 
-    decorated.print_counter = print_counter()
+    decorated.print_counter = print_counter
 
     return decorated
 
@@ -80,6 +96,127 @@ def delayed_start(func):
         ...
     return wrapper
 
+# 在 wrapper 里调用 time.sleep() 会阻塞当前线程。更好的做法是把任务交给调度器，
+# 调度器用一个堆保存所有延迟任务，由单个后台线程在到期时把任务交给线程池执行
+class DelayedScheduler:
+    """延迟任务调度器，无论有多少个等待中的任务，都只使用一个调度线程
+
+    :param max_workers: 执行到期任务的线程数
+    """
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._shutdown = False
+        self._cancel_pending = False
+
+    def schedule(self, delay, func, *args, **kwargs) -> Future:
+        """在 delay 秒后执行 func，立即返回 Future 对象，调用 future.cancel() 可以取消任务"""
+        return self.schedule_at(time.monotonic() + delay, func, *args, **kwargs)
+
+    def schedule_at(self, run_at, func, *args, **kwargs) -> Future:
+        """在 time.monotonic() 时间为 run_at 时执行 func"""
+        future = Future()
+        with self._cond:
+            if self._shutdown:
+                raise RuntimeError('scheduler has been shut down')
+            heapq.heappush(self._heap, (run_at, next(self._seq), future, func, args, kwargs))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='delayed-scheduler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def _run(self):
+        with self._cond:
+            while True:
+                if self._shutdown and (self._cancel_pending or not self._heap):
+                    self._executor.shutdown(wait=False)
+                    return
+                timeout = self._heap[0][0] - time.monotonic() if self._heap else None
+                if timeout is None or timeout > 0:
+                    self._cond.wait(timeout)
+                    continue
+                _, _, future, func, args, kwargs = heapq.heappop(self._heap)
+                # 已取消的任务在这里被跳过，不需要从堆中删除。任务在持有锁时提交，
+                # 线程池只会在此之后由调度线程关闭，所以提交不会失败
+                if future.set_running_or_notify_cancel():
+                    self._executor.submit(self._call, future, func, args, kwargs)
+
+    @staticmethod
+    def _call(future, func, args, kwargs):
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    def pending_count(self) -> int:
+        """返回等待中的任务数（包括已取消但尚未到期的任务）"""
+        with self._cond:
+            return len(self._heap)
+
+    def shutdown(self, cancel_pending=True):
+        """停止调度器，不再接受新任务
+
+        :param cancel_pending: 为 True 时取消所有等待中的任务；为 False 时等待中的任务仍会按时执行，
+            全部提交后调度线程才退出
+        """
+        pending = []
+        with self._cond:
+            if self._shutdown:
+                return
+            self._shutdown = True
+            self._cancel_pending = cancel_pending
+            if cancel_pending:
+                pending, self._heap = self._heap, []
+            if self._thread is None:
+                self._executor.shutdown(wait=False)
+            self._cond.notify()
+        for _, _, future, *_ in pending:
+            future.cancel()
+
+
+_default_scheduler = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_default_scheduler() -> DelayedScheduler:
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = DelayedScheduler()
+        return _default_scheduler
+
+
+def delayed_start(duration=1, *, jitter=0, rate_limit=None, scheduler=None):
+    """装饰器：延迟 duration 秒后执行函数，调用时立即返回 Future 对象
+
+    :param jitter: 随机增加 0 到 jitter 秒的延迟，避免大量任务在同一时刻触发
+    :param rate_limit: 每秒最多开始执行的次数，超出的调用会被顺延，None 代表不限制
+    :param scheduler: 使用的调度器，默认使用全局调度器
+    """
+
+    def decorator(func):
+        next_slot = 0.0
+        lock = threading.Lock()
+
+        @wraps(func)
+        def wrapper(*args, **kwargs) -> Future:
+            nonlocal next_slot
+            run_at = time.monotonic() + duration + random.uniform(0, jitter)
+            if rate_limit is not None:
+                with lock:
+                    run_at = max(run_at, next_slot)
+                    next_slot = run_at + 1 / rate_limit
+            return (scheduler or get_default_scheduler()).schedule_at(run_at, func, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
 # 8.1.4 用类来实现装饰器（函数替换）
 class Foo:
     def __call__(self, name):
@@ -110,6 +247,419 @@ class timer:
         return decorated
 
 
+# lru_cache 用在协程函数上时，缓存的是协程对象而不是结果，第二次 await 会直接报错。
+# 下面的装饰器缓存的是 await 之后的结果
+CacheInfo = namedtuple('CacheInfo', 'hits misses maxsize currsize')
+
+
+class AsyncLRUCache:
+    """协程函数的 LRU 缓存
+
+    同一个键的多个并发调用共享同一个任务。某个调用方被取消时不会影响其他调用方，
+    只有当所有调用方都被取消后，任务才会被取消。任务抛出异常时不缓存结果。
+
+    :param func: 被缓存的协程函数，参数需要可哈希
+    :param maxsize: 最多缓存的结果数量，None 代表不限制
+    """
+
+    def __init__(self, func, maxsize=128):
+        self.func = func
+        self.maxsize = maxsize
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self._waiters = Counter()
+        self._hits = self._misses = 0
+
+    async def __call__(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.items())))
+        if key in self._results:
+            self._results.move_to_end(key)
+            self._hits += 1
+            return self._results[key]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            self._misses += 1
+            task = self._in_flight[key] = asyncio.ensure_future(self.func(*args, **kwargs))
+            task.add_done_callback(functools.partial(self._on_done, key))
+
+        self._waiters[task] += 1
+        try:
+            # shield 保证当前调用方被取消时，共享的任务不会跟着被取消
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1 and not task.done():
+                # 已取消的任务不能再被后续调用方复用
+                self._in_flight.pop(key, None)
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    def _on_done(self, key, task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._results[key] = task.result()
+        if self.maxsize is not None and len(self._results) > self.maxsize:
+            self._results.popitem(last=False)
+
+    def cache_info(self) -> CacheInfo:
+        return CacheInfo(self._hits, self._misses, self.maxsize, len(self._results))
+
+    def cache_clear(self):
+        self._results.clear()
+        self._hits = self._misses = 0
+
+
+def async_lru_cache(maxsize=128):
+    """装饰器：为协程函数添加 LRU 缓存，用法与 lru_cache 一致"""
+
+    def decorator(func):
+        cache = AsyncLRUCache(func, maxsize)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            return await cache(*args, **kwargs)
+
+        wrapper.cache_info = cache.cache_info
+        wrapper.cache_clear = cache.cache_clear
+        return wrapper
+
+    return decorator
+
+
+@async_lru_cache()
+async def calculate_score_async(class_id):
+    print(f'calculating {class_id}')
+    await asyncio.sleep(12)
+    return 42
+
+
+# 每次调用都 print 耗时的开销很大，也无法得到汇总数据。下面的装饰器只在内存中累加统计信息：
+# 每个线程写入自己的统计对象，不需要加锁，读取时再汇总
+class _ShardOwner:
+    """保存单个线程的全部分片，线程退出时随线程局部数据一起被回收"""
+
+    __slots__ = ('shards', '__weakref__')
+
+    def __init__(self):
+        self.shards = {}
+
+
+class _ThreadShards:
+    """按线程与名称划分的分片集合：每个线程只写入自己的分片，线程退出后分片被合并到“已退出”分片中，
+    因此频繁创建短生命周期线程也不会让分片数量无限增长
+
+    :param new_shard: 接收名称，返回一个空分片
+    :param merge: merge(target, shard)，把 shard 的数据累加到 target 上
+    """
+
+    def __init__(self, new_shard, merge):
+        self._new_shard = new_shard
+        self._merge = merge
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._live = defaultdict(list)
+        self._retired = {}
+        self._generation = 0
+        # 已退出线程的分片。finalize 回调可能在任意时刻触发（包括持有锁时），
+        # 所以回调只把分片放入队列，等下次持有锁时再合并
+        self._dead = deque()
+
+    def get(self, name):
+        """返回当前线程中名为 name 的分片，不存在时创建"""
+        try:
+            return self._local.owner.shards[name]
+        except AttributeError:
+            owner = self._local.owner = _ShardOwner()
+            weakref.finalize(owner, self._dead.append, (owner.shards, self._generation))
+        except KeyError:
+            owner = self._local.owner
+        shard = owner.shards[name] = self._new_shard(name)
+        with self._lock:
+            self._retire_dead()
+            self._live[name].append(shard)
+        return shard
+
+    def _retire_dead(self):
+        """把已退出线程的分片合并到“已退出”分片中，调用方需持有锁"""
+        while self._dead:
+            shards, generation = self._dead.popleft()
+            if generation != self._generation:
+                continue
+            for name, shard in shards.items():
+                self._live[name].remove(shard)
+                # 创建新的合并结果而不是原地修改，正在汇总的读取方不会重复计算同一个分片
+                retired = self._new_shard(name)
+                if name in self._retired:
+                    self._merge(retired, self._retired[name])
+                self._merge(retired, shard)
+                self._retired[name] = retired
+
+    def shards(self, name) -> list:
+        """返回名为 name 的所有分片"""
+        with self._lock:
+            self._retire_dead()
+            return self._collect(name)
+
+    def items(self) -> list:
+        """返回 [(名称, 分片列表), ...]"""
+        with self._lock:
+            self._retire_dead()
+            return [(name, self._collect(name)) for name in self._live.keys() | self._retired.keys()]
+
+    def _collect(self, name):
+        shards = list(self._live.get(name, ()))
+        if name in self._retired:
+            shards.append(self._retired[name])
+        return shards
+
+    def clear(self):
+        """清空所有分片，仍在运行的线程会在下次写入时创建新分片"""
+        with self._lock:
+            self._live.clear()
+            self._retired.clear()
+            self._dead.clear()
+            self._generation += 1
+            self._local = threading.local()
+
+
+class _FuncStats:
+    """单个线程内某个函数的统计数据，耗时单位为纳秒"""
+
+    __slots__ = ('calls', 'sampled', 'total', 'min', 'max', 'buckets')
+
+    def __init__(self):
+        self.calls = 0
+        self.sampled = 0
+        self.total = 0
+        self.min = None
+        self.max = 0
+        # 第 i 个桶记录耗时在 [2^(i-1), 2^i) 纳秒之间的调用次数
+        self.buckets = [0] * 64
+
+    def record(self, cost):
+        self.sampled += 1
+        self.total += cost
+        if self.min is None or cost < self.min:
+            self.min = cost
+        if cost > self.max:
+            self.max = cost
+        self.buckets[min(cost.bit_length(), 63)] += 1
+
+    def merge(self, other: '_FuncStats'):
+        self.calls += other.calls
+        self.sampled += other.sampled
+        self.total += other.total
+        if other.min is not None and (self.min is None or other.min < self.min):
+            self.min = other.min
+        self.max = max(self.max, other.max)
+        self.buckets = [x + y for x, y in zip(self.buckets, other.buckets)]
+
+
+class ProfileRegistry:
+    """函数耗时统计的注册表"""
+
+    def __init__(self):
+        self._stats = _ThreadShards(lambda name: _FuncStats(), _FuncStats.merge)
+
+    def profile(self, func=None, *, sample_rate=1, name=None):
+        """装饰器：统计函数的调用次数与耗时，支持普通函数、协程函数与方法
+
+        :param sample_rate: 采样率，为 N 时每 N 次调用只计时一次，调用次数依然精确统计
+        :param name: 统计名称，默认为“模块名.函数的 __qualname__”
+        """
+        if func is None:
+            return functools.partial(self.profile, sample_rate=sample_rate, name=name)
+
+        name = name or f'{func.__module__}.{func.__qualname__}'
+        perf_counter_ns = time.perf_counter_ns
+
+        if inspect.iscoroutinefunction(func):
+
+            @wraps(func)
+            async def decorated(*args, **kwargs):
+                stats = self._stats.get(name)
+                stats.calls += 1
+                if stats.calls % sample_rate:
+                    return await func(*args, **kwargs)
+                st = perf_counter_ns()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    stats.record(perf_counter_ns() - st)
+
+        else:
+
+            @wraps(func)
+            def decorated(*args, **kwargs):
+                stats = self._stats.get(name)
+                stats.calls += 1
+                if stats.calls % sample_rate:
+                    return func(*args, **kwargs)
+                st = perf_counter_ns()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    stats.record(perf_counter_ns() - st)
+
+        return decorated
+
+    def snapshot(self) -> dict:
+        """汇总所有线程的统计数据，耗时单位为秒
+
+        读取时不会阻塞被统计的函数，因此结果可能略微落后于正在进行的调用。
+        """
+        report = {}
+        for name, stats_list in self._stats.items():
+            sampled = sum(stats.sampled for stats in stats_list)
+            total = sum(stats.total for stats in stats_list)
+            mins = [stats.min for stats in stats_list if stats.min is not None]
+            buckets = [sum(counts) for counts in zip(*(stats.buckets for stats in stats_list))]
+            report[name] = {
+                'calls': sum(stats.calls for stats in stats_list),
+                'sampled': sampled,
+                'total': total / 1e9,
+                'avg': total / sampled / 1e9 if sampled else None,
+                'min': min(mins) / 1e9 if mins else None,
+                'max': max(stats.max for stats in stats_list) / 1e9,
+                'histogram': {f'<{2 ** i / 1e9:g}s': count for i, count in enumerate(buckets) if count},
+            }
+        return report
+
+    def to_json(self, **kwargs) -> str:
+        """以 JSON 格式导出统计数据"""
+        return json.dumps(self.snapshot(), **kwargs)
+
+    def reset(self):
+        """清空所有统计数据"""
+        self._stats.clear()
+
+
+profile_registry = ProfileRegistry()
+profile = profile_registry.profile
+
+
+@profile(sample_rate=10)
+def random_sleep():
+    time.sleep(random.random() / 1000)
+
+
+for _ in range(20):
+    random_sleep()
+print(profile_registry.to_json(indent=2))
+
+
+# calls_counter 里的 counter += 1 不是线程安全的。下面的计数器让每个线程只修改自己的分片，
+# 读取时再把所有分片相加
+class _CounterShard:
+    """单个线程内某个函数的调用计数
+
+    :param capacity: 最多跟踪的参数键数量
+    """
+
+    __slots__ = ('calls', 'key_counts', 'capacity')
+
+    def __init__(self, capacity):
+        self.calls = 0
+        self.key_counts = {}
+        self.capacity = capacity
+
+    def track(self, key):
+        """统计参数键的调用次数
+
+        键的数量达到 capacity 时，只保留计数最高的一半，其余丢弃。高频键总能保留下来，
+        内存占用不超过 capacity，每次调用的均摊开销也很低；代价是被丢弃过的键计数会偏小。
+        """
+        key_counts = self.key_counts
+        if key in key_counts:
+            key_counts[key] += 1
+            return
+        if len(key_counts) >= self.capacity:
+            kept = heapq.nlargest(self.capacity // 2, key_counts.items(), key=itemgetter(1))
+            key_counts.clear()
+            key_counts.update(kept)
+        key_counts[key] = 1
+
+    def merge(self, other: '_CounterShard'):
+        self.calls += other.calls
+        key_counts = Counter(self.key_counts)
+        key_counts.update(other.key_counts)
+        if len(key_counts) > self.capacity:
+            key_counts = dict(key_counts.most_common(self.capacity))
+        self.key_counts = dict(key_counts)
+
+
+class CallCounterRegistry:
+    """函数调用计数器的注册表"""
+
+    def __init__(self):
+        self._top_k = {}
+        self._capacities = {}
+        self._shards = _ThreadShards(lambda name: _CounterShard(self._capacities[name]), _CounterShard.merge)
+
+    def count_calls(self, func=None, *, key_func=None, top_k=10, name=None):
+        """装饰器：统计函数被调用了多少次
+
+        :param key_func: 接收与被装饰函数相同的参数，返回用于分组统计的键，为 None 时不按参数统计
+        :param top_k: 按参数统计时，报告里保留调用次数最多的 top_k 个键
+        :param name: 统计名称，默认为“模块名.函数的 __qualname__”
+        """
+        if func is None:
+            return functools.partial(self.count_calls, key_func=key_func, top_k=top_k, name=name)
+
+        name = name or f'{func.__module__}.{func.__qualname__}'
+        self._top_k[name] = top_k
+        # 跟踪比 top_k 多得多的键，让新出现的高频键有机会积累计数
+        self._capacities[name] = max(top_k * 100, 1000)
+
+        @wraps(func)
+        def decorated(*args, **kwargs):
+            shard = self._shards.get(name)
+            shard.calls += 1
+            if key_func is not None:
+                shard.track(key_func(*args, **kwargs))
+            return func(*args, **kwargs)
+
+        decorated.get_count = functools.partial(self.get_count, name)
+        return decorated
+
+    def get_count(self, name) -> int:
+        """返回某个函数的总调用次数"""
+        return sum(shard.calls for shard in self._shards.shards(name))
+
+    def dump(self) -> dict:
+        """返回所有计数器的数据：{名称: {'calls': 总次数, 'top_keys': [(键, 次数), ...]}}"""
+        result = {}
+        for name, shards in self._shards.items():
+            key_counts = Counter()
+            for shard in shards:
+                key_counts.update(shard.key_counts.copy())
+            result[name] = {
+                'calls': sum(shard.calls for shard in shards),
+                'top_keys': key_counts.most_common(self._top_k[name]),
+            }
+        return result
+
+
+counter_registry = CallCounterRegistry()
+count_calls = counter_registry.count_calls
+
+
+@count_calls(key_func=lambda user_id: user_id, top_k=3)
+def get_user(user_id):
+    return {'id': user_id}
+
+
+for user_id in [1, 2, 1, 3, 1, 2, 4]:
+    get_user(user_id)
+print(counter_registry.dump())
+
+
 # 装饰器模式
 class Numbers:
     """一个包含多个数字的简单类"""
@@ -130,6 +680,13 @@ class EvenOnlyDecorator:
     def get(self):
         return [num for num in self.decorated.get() if num % 2 == 0]
 
+    def predicate(self, num):
+        return num % 2 == 0
+
+    def mask(self, numbers):
+        """对 NumPy 数组返回布尔掩码"""
+        return numbers % 2 == 0
+
 
 class GreaterThanDecorator:
     """装饰器类：过滤大于某个数的数"""
@@ -141,12 +698,72 @@ class GreaterThanDecorator:
     def get(self):
         return [num for num in self.decorated.get() if num > self.min_value]
 
+    def predicate(self, num):
+        return num > self.min_value
+
+    def mask(self, numbers):
+        """对 NumPy 数组返回布尔掩码"""
+        return numbers > self.min_value
+
 
 obj = Numbers([42, 12, 13, 17, 18, 41, 32])
 even_obj = EvenOnlyDecorator(obj)
 gt_obj = GreaterThanDecorator(even_obj, min_value=30)
 print(gt_obj.get())
 
+
+# 每层装饰器都会生成一个完整的新列表，层数多、数据量大时开销可观。
+# FusedFilter 把多层装饰器的过滤条件合并起来，只遍历一次原始数据
+class FusedFilter:
+    """将层层嵌套的过滤装饰器合并为一个惰性管道
+
+    沿着 decorated 属性向内查找，所有提供了 predicate() 方法的装饰器都会被合并，
+    遇到的第一个其他对象被当作数据源。
+
+    :param decorated: 最外层的装饰器对象
+    """
+
+    def __init__(self, decorated):
+        self.filters = []
+        while hasattr(decorated, 'predicate') and hasattr(decorated, 'decorated'):
+            self.filters.append(decorated)
+            decorated = decorated.decorated
+        # 保持与嵌套调用相同的过滤顺序：由内向外
+        self.filters.reverse()
+        self.source = decorated
+
+    def __iter__(self):
+        predicates = [f.predicate for f in self.filters]
+        for num in self.source.get():
+            for predicate in predicates:
+                if not predicate(num):
+                    break
+            else:
+                yield num
+
+    def get(self):
+        """与装饰器类一致的接口，返回结果列表"""
+        return list(self)
+
+    def iter_chunks(self, chunk_size=65536):
+        """按块返回结果。数据源是 NumPy 数组时，使用布尔掩码一次过滤一整块"""
+        numbers = self.source.get()
+        if np is not None and isinstance(numbers, np.ndarray):
+            for start in range(0, len(numbers), chunk_size):
+                block = numbers[start : start + chunk_size]
+                mask = np.ones(len(block), dtype=bool)
+                for f in self.filters:
+                    mask &= f.mask(block)
+                yield block[mask]
+            return
+
+        iterator = iter(self)
+        while chunk := list(itertools.islice(iterator, chunk_size)):
+            yield chunk
+
+
+print(FusedFilter(gt_obj).get())
+
 """
 （1）基础与技巧· 装饰器最常见的实现方式，是利用闭包原理通过多层嵌套函数实现· 在实现装饰器时，请记得使用wraps()更新包装函数的元数据· 
 wraps()不光可以保留元数据，还能保留包装函数的额外属性· 利用仅限关键字参数，可以很方便地实现可选参数的装饰器
@@ -1,5 +1,15 @@
+import array
 import random
+import operator
 import os
+import sys
+import tracemalloc
+from dataclasses import dataclass, fields
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
 
 
 """
@@ -8,6 +18,8 @@ import os
 
 
 class Duck:
+    colors = ('yellow', 'white', 'black')
+
     def __init__(self, color):
         self.color = color
 
@@ -21,7 +33,7 @@ class Duck:
 
     @classmethod
     def create_random(cls):
-        color = random.choice(["yellow", "white", "black"])
+        color = random.choice(cls.colors)
         return cls(color=color)
 
 
@@ -29,6 +41,87 @@ d = Duck.create_random()
 d.quack()
 
 
+# 需要生成大量鸭子时，用“数组结构”代替大量独立对象：所有颜色保存在一个小整数数组里
+class DuckView:
+    """DuckBatch 中单只鸭子的轻量视图，只保存批次与下标"""
+
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    @property
+    def color(self):
+        return self._batch.colors[self._batch.color_codes[self._index]]
+
+    def quack(self):
+        print(f"Hi, I'm a {self.color} duck!")
+
+
+class DuckBatch:
+    """批量保存鸭子的容器，颜色以 colors 中的下标保存，每只鸭子只占 1 个字节
+
+    :param color_codes: 颜色编码数组，array.array('B') 或 uint8 类型的 NumPy 数组
+    """
+
+    colors = Duck.colors
+
+    def __init__(self, color_codes):
+        self.color_codes = color_codes
+
+    @classmethod
+    def create_random(cls, number, seed=None):
+        """一次性随机生成 number 只鸭子
+
+        :param seed: 随机数种子，相同的种子会生成相同的鸭子。
+            安装与未安装 NumPy 时使用的随机数生成器不同，生成的结果也不同
+        """
+        if np is not None:
+            rng = np.random.default_rng(seed)
+            return cls(rng.integers(0, len(cls.colors), size=number, dtype=np.uint8))
+        rng = random.Random(seed)
+        return cls(array.array('B', rng.choices(range(len(cls.colors)), k=number)))
+
+    def __len__(self):
+        return len(self.color_codes)
+
+    def __getitem__(self, index):
+        """按下标返回单只鸭子的视图，按切片返回新的批次（NumPy 数组的切片不会复制数据）"""
+        if isinstance(index, slice):
+            return type(self)(self.color_codes[index])
+        index = operator.index(index)
+        if not -len(self) <= index < len(self):
+            raise IndexError('duck index out of range')
+        return DuckView(self, index % len(self))
+
+    def __iter__(self):
+        return (DuckView(self, i) for i in range(len(self)))
+
+    def count_colors(self):
+        """统计每种颜色的鸭子数量"""
+        if np is not None and isinstance(self.color_codes, np.ndarray):
+            counts = np.bincount(self.color_codes, minlength=len(self.colors)).tolist()
+        else:
+            counts = [self.color_codes.count(code) for code in range(len(self.colors))]
+        return dict(zip(self.colors, counts))
+
+    def quack_all(self, fp=None, chunk_size=65536):
+        """让所有鸭子依次叫一遍，每块鸭子的输出拼接后一次写入 fp
+
+        :param fp: 可写的文本文件对象，默认为标准输出
+        """
+        fp = fp or sys.stdout
+        lines = [f"Hi, I'm a {color} duck!\n" for color in self.colors]
+        for start in range(0, len(self), chunk_size):
+            codes = self.color_codes[start : start + chunk_size]
+            fp.write(''.join([lines[code] for code in codes.tolist()]))
+
+
+ducks = DuckBatch.create_random(3, seed=42)
+ducks.quack_all()
+
+
 class Cat:
     def __init__(self, name):
         self.name = name
@@ -70,6 +163,100 @@ p.basename = 'bar.txt'
 print(p.path)
 # del p.basename
 
+
+# 每次访问 basename 都要重新切分 path。处理大量路径时，可以缓存解析结果，并在 path 被修改时失效
+class CachedFilePath:
+    """缓存解析结果的文件路径，用法与 FilePath 相同
+
+    相同的父目录字符串会通过 sys.intern 共享同一个对象，处理同一目录下的大量文件时更省内存。
+    """
+
+    __slots__ = ('_path', '_parent', '_basename')
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        self._path = path
+        self._parent = self._basename = None
+
+    def _parse(self):
+        parent, sep, basename = self._path.rpartition(os.sep)
+        # 路径中没有分隔符时，父目录为空字符串，且不需要拼接分隔符
+        self._parent = sys.intern(parent + sep) if sep else ''
+        self._basename = basename
+
+    @property
+    def parent(self):
+        """获取父目录部分（包含末尾的分隔符）"""
+        if self._basename is None:
+            self._parse()
+        return self._parent
+
+    @property
+    def basename(self):
+        """获取文件名"""
+        if self._basename is None:
+            self._parse()
+        return self._basename
+
+    @basename.setter
+    def basename(self, name):
+        """修改当前路径里的文件名部分，父目录的解析结果可以继续使用"""
+        parent = self.parent
+        self._path = parent + name
+        self._basename = name
+
+    @basename.deleter
+    def basename(self):
+        raise RuntimeError('Can not delete basename!')
+
+
+def rename_tree(root, rename_func, dry_run=True):
+    """遍历目录树，按 rename_func 批量修改文件名，每个目录只扫描一次
+
+    每个目录先算出全部改名计划再执行，避免边遍历边修改同一个目录。
+    新文件名已存在，或者多个文件要改成同一个名字时，跳过并记录冲突。
+
+    :param root: 根目录
+    :param rename_func: 接收原文件名，返回新文件名，返回 None 或原文件名代表不改名
+    :param dry_run: 为 True 时只返回计划，不真正改名
+    :return: (改名列表 [(原路径, 新路径)], 冲突列表 [(原路径, 新路径)])
+    """
+    renamed, conflicts = [], []
+    pending_dirs = [root]
+    while pending_dirs:
+        dir_path = pending_dirs.pop()
+        plan = []
+        with os.scandir(dir_path) as entries:
+            existing_names = set()
+            for entry in entries:
+                existing_names.add(entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    pending_dirs.append(entry.path)
+                    continue
+                new_name = rename_func(entry.name)
+                if new_name and new_name != entry.name:
+                    plan.append((CachedFilePath(entry.path), new_name))
+
+        for file_path, new_name in plan:
+            old_path, old_name = file_path.path, file_path.basename
+            if new_name in existing_names:
+                conflicts.append((old_path, file_path.parent + new_name))
+                continue
+            file_path.basename = new_name
+            if not dry_run:
+                os.rename(old_path, file_path.path)
+            existing_names.discard(old_name)
+            existing_names.add(new_name)
+            renamed.append((old_path, file_path.path))
+    return renamed, conflicts
+
 # 鸭子类型是一种编程风格 鸭子类型只关心行为，不关心类型
 
 
@@ -81,19 +268,112 @@ print(p.path)
 
 class InfoDumperMixin:
     """Mixin：输出当前实例信息"""
+
+    # 声明空的 __slots__，使用 __slots__ 的子类才不会因为混入本类而重新拥有 __dict__
+    __slots__ = ()
+
     def dump_info(self):
-        d = self.__dict__
+        d = self._get_members()
         print("Number of members: {}".format(len(d)))
         print("Details:")
         for key, value in d.items():
             print(f' - {key}: {value}')
 
+    def _get_members(self):
+        if hasattr(self, '__dict__'):
+            return self.__dict__
+        # 使用 __slots__ 的实例没有 __dict__，沿着 MRO 收集所有已赋值的槽位
+        return {
+            name: getattr(self, name)
+            for klass in reversed(type(self).__mro__)
+            for name in getattr(klass, '__slots__', ())
+            if hasattr(self, name)
+        }
+
 class Person(InfoDumperMixin):
     def __init__(self, name, age):
         self.name = name
         self.age = age
 
 
+# 大量实例常驻内存时，每个实例的 __dict__ 会占用可观的内存。
+# record 装饰器基于 dataclass 生成使用 __slots__ 的类，实例不再拥有 __dict__
+def record(cls=None, *, frozen=False):
+    """类装饰器：把带类型注解的类转换为使用 __slots__ 的数据类
+
+    :param frozen: 是否声明为不可变类型
+    """
+
+    def wrap(cls):
+        return dataclass(cls, slots=True, frozen=frozen)
+
+    return wrap if cls is None else wrap(cls)
+
+
+@record
+class PersonRecord(InfoDumperMixin):
+    name: str
+    age: int
+
+
+class ColumnStore:
+    """按列保存大量记录，每个字段一个列表或 array.array，只在访问时才创建记录对象
+
+    :param record_cls: 由 record 装饰器生成的记录类
+    :param typecodes: 可选，{字段名: array 类型码}，比如 {'age': 'H'}，数值字段使用 array 更省内存
+    """
+
+    def __init__(self, record_cls, typecodes=None):
+        self.record_cls = record_cls
+        self.field_names = [f.name for f in fields(record_cls)]
+        typecodes = typecodes or {}
+        self.columns = {
+            name: array.array(typecodes[name]) if name in typecodes else [] for name in self.field_names
+        }
+
+    def append(self, *args, **kwargs):
+        """追加一条记录，参数与 record_cls 的构造函数一致"""
+        values = dict(zip(self.field_names, args), **kwargs)
+        for name in self.field_names:
+            self.columns[name].append(values[name])
+
+    def __len__(self):
+        return len(self.columns[self.field_names[0]])
+
+    def __getitem__(self, index):
+        return self.record_cls(*(self.columns[name][index] for name in self.field_names))
+
+    def __iter__(self):
+        columns = [self.columns[name] for name in self.field_names]
+        return (self.record_cls(*values) for values in zip(*columns))
+
+
+def bench_record_memory(number=100_000):
+    """使用 tracemalloc 对比不同存储方式保存 number 个人员信息时占用的内存"""
+
+    def build_plain():
+        return [Person(f'user{i}', i % 100) for i in range(number)]
+
+    def build_slots():
+        return [PersonRecord(f'user{i}', i % 100) for i in range(number)]
+
+    def build_columns():
+        store = ColumnStore(PersonRecord, typecodes={'age': 'B'})
+        for i in range(number):
+            store.append(f'user{i}', i % 100)
+        return store
+
+    for build in (build_plain, build_slots, build_columns):
+        tracemalloc.start()
+        data = build()
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f'{build.__name__}: {current / 1024 / 1024:.1f} MiB')
+        del data
+
+
+PersonRecord('piglei', 18).dump_info()
+print(PersonRecord('piglei', 18))
 
 """
 （1）语言基础知识· 类与实例的数据，都保存在一个名为__dict__的字典属性中· 灵活利用__dict__属性，能帮你做到常规做法难以完成的一些事情· 